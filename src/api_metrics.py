@@ -0,0 +1,165 @@
+from contextvars import ContextVar
+import threading
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable
+
+METRICS_PREFIX: str = "news_api"
+# Requests slower than this are printed with their timing breakdown; 0 turns the log off
+SLOW_REQUEST_MS: float = float(os.getenv("SLOW_REQUEST_MS", "0"))
+LATENCY_BUCKETS: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS: List[float] = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+# Per-request timings filled in by the data layer while the request runs; None outside a request
+request_timings: ContextVar[Union[Dict[str, float], None]] = ContextVar("request_timings", default=None)
+
+def add_request_timing(name: str, seconds: float) -> None:
+    timings: Union[Dict[str, float], None] = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Histogram:
+    # Prometheus-style cumulative buckets, one series per label set
+    def __init__(self, name: str, help: str, label_names: List[str], buckets: List[float]):
+        self.name: str = name
+        self.help: str = help
+        self.label_names: List[str] = label_names
+        self.buckets: List[float] = buckets
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        # [count per bucket..., +Inf count, sum]; callers hold the registry lock
+        series: List[float] = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines: List[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            label_dict: Dict[str, str] = dict(zip(self.label_names, labels))
+            for bound, count in zip([*map(format_value, self.buckets), "+Inf"], series[:-1]):
+                lines.append(f"{self.name}_bucket{format_labels({**label_dict, 'le': bound})} {format_value(count)}")
+            lines.append(f"{self.name}_sum{format_labels(label_dict)} {format_value(series[-1])}")
+            lines.append(f"{self.name}_count{format_labels(label_dict)} {format_value(series[len(self.buckets)])}")
+        return lines
+
+class Metrics:
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.latency: Histogram = Histogram(f"{METRICS_PREFIX}_request_duration_seconds", "Request latency by route",
+                                            ["method", "route", "status"], LATENCY_BUCKETS)
+        self.response_size: Histogram = Histogram(f"{METRICS_PREFIX}_response_bytes", "Response body bytes as sent, by route",
+                                                  ["method", "route"], SIZE_BUCKETS)
+        self.in_flight: int = 0
+        self.counters: Dict[str, Tuple[str, float]] = {}
+        # name -> (help, function returning current values); read at scrape time from the caches' own stats()
+        self.collectors: Dict[str, Tuple[str, Callable[[], Dict[str, Any]]]] = {}
+
+    def increment(self, name: str, help: str, amount: float = 1) -> None:
+        with self.lock:
+            previous: Tuple[str, float] = self.counters.get(name, (help, 0))
+            self.counters[name] = (help, previous[1] + amount)
+
+    def add_collector(self, name: str, help: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        self.collectors[name] = (help, collect)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, body_bytes: int) -> None:
+        with self.lock:
+            self.latency.observe((method, route, str(status)), seconds)
+            self.response_size.observe((method, route), body_bytes)
+
+    def render(self) -> str:
+        with self.lock:
+            lines: List[str] = [*self.latency.render(), *self.response_size.render(),
+                                f"# HELP {METRICS_PREFIX}_requests_in_flight Requests being handled",
+                                f"# TYPE {METRICS_PREFIX}_requests_in_flight gauge",
+                                f"{METRICS_PREFIX}_requests_in_flight {self.in_flight}"]
+            for name, (help, value) in sorted(self.counters.items()):
+                lines.extend([f"# HELP {METRICS_PREFIX}_{name}_total {help}", f"# TYPE {METRICS_PREFIX}_{name}_total counter",
+                              f"{METRICS_PREFIX}_{name}_total {format_value(value)}"])
+        for name, (help, collect) in sorted(self.collectors.items()):
+            for key, value in flatten(collect()).items():
+                # hits and misses only grow, everything else (entries, bytes) is a current level
+                kind: str = "counter" if key.endswith(("hits", "misses", "calls", "swaps")) else "gauge"
+                metric: str = f"{METRICS_PREFIX}_{name}_{key}{'_total' if kind == 'counter' else ''}"
+                lines.extend([f"# HELP {metric} {help}: {key.replace('_', ' ')}", f"# TYPE {metric} {kind}",
+                              f"{metric} {format_value(value)}"])
+        return "\n".join(lines) + "\n"
+
+def flatten(values: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    # {"answers": {"hits": 3}} -> {"answers_hits": 3}; non-numeric values are dropped
+    flat: Dict[str, float] = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}_"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+class MetricsMiddleware:
+    # Pure ASGI, so it times the whole response including streaming and sees the bytes after compression
+    def __init__(self, app: Any, metrics: "Metrics" = None, slow_request_ms: float = SLOW_REQUEST_MS):
+        self.app: Any = app
+        self.metrics: Metrics = metrics or get_metrics()
+        self.slow_request_ms: float = slow_request_ms
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        st: float = time.perf_counter()
+        state: Dict[str, Any] = {"status": 500, "bytes": 0, "first_byte": None}
+        timings: Dict[str, float] = {}
+        token = request_timings.set(timings)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["first_byte"] = time.perf_counter() - st
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        with self.metrics.lock:
+            self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            with self.metrics.lock:
+                self.metrics.in_flight -= 1
+            request_timings.reset(token)
+            seconds: float = time.perf_counter() - st
+            # The route template ("/summaries/{category}/all"), set on the scope by the router; unmatched paths share
+            # one label so scanners cannot blow up the series count
+            route: Any = scope.get("route")
+            route_path: str = getattr(route, "path", None) or "unmatched"
+            self.metrics.observe_request(scope["method"], route_path, state["status"], seconds, state["bytes"])
+            if self.slow_request_ms and seconds * 1000 >= self.slow_request_ms:
+                first_byte: float = state["first_byte"] if state["first_byte"] is not None else seconds
+                breakdown: str = ", ".join(f"{name} {value * 1000:.1f} ms" for name, value in sorted(timings.items()))
+                print(f"Slow request: {scope['method']} {scope['path']} {state['status']} {seconds * 1000:.1f} ms "
+                      f"(first byte {first_byte * 1000:.1f} ms, body {(seconds - first_byte) * 1000:.1f} ms"
+                      f"{', ' + breakdown if breakdown else ''}, {state['bytes']} bytes)")
+
+_metrics: Union[Metrics, None] = None
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
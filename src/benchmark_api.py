@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+import threading
+import argparse
+import tempfile
+import random
+import string
+import json
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+
+def make_day(data_directory: str, date: str, clusters: int, article_kb: int) -> None:
+    # Summary files shaped like the pipeline's: a short summary plus every article's full text in meta_data
+    for category in ["business", "pakistan"]:
+        for section in ["summary", "stats"]:
+            os.makedirs(os.path.join(data_directory, date, category, section), exist_ok=True)
+        for c in range(clusters):
+            text: str = " ".join("".join(random.choices(string.ascii_lowercase, k=7)) for _ in range(article_kb * 128))
+            meta: List[Dict[str, Any]] = [{"id": a, "title": f"Article {a}", "source": "dawn", "url": f"https://example.com/{c}/{a}",
+                                           "publish_date": f"{date}T09:00:00", "text": text} for a in range(5)]
+            with open(os.path.join(data_directory, date, category, "summary", f"{c}.json"), 'w', encoding='utf-8') as file:
+                json.dump({"summary": text[:1000], "meta_data": meta}, file)
+            with open(os.path.join(data_directory, date, category, "stats", f"{c}.json"), 'w', encoding='utf-8') as file:
+                json.dump([{"object": "Figures", "headings": ["Item", "Value"], "data": [["a", "1"], ["b", "2"]]}], file)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered: List[float] = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+def timed_request(url: str, body: Union[bytes, None]) -> float:
+    st: float = time.perf_counter()
+    request: urllib.request.Request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+    return time.perf_counter() - st
+
+def run_load(base_url: str, path: str, body: bytes, concurrency: int, requests: int) -> Dict[str, float]:
+    # `concurrency` clients fetch the day while one more pings a trivial route; the ping latency shows how long
+    # the event loop is stalled by the data requests
+    load_latencies: List[float] = []
+    ping_latencies: List[float] = []
+    done: threading.Event = threading.Event()
+
+    def ping() -> None:
+        while not done.is_set():
+            ping_latencies.append(timed_request(f"{base_url}/benchmark/ping", None))
+            time.sleep(0.01)
+
+    pinger: threading.Thread = threading.Thread(target=ping, daemon=True)
+    pinger.start()
+    st: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        load_latencies.extend(pool.map(lambda _: timed_request(f"{base_url}{path}", body), range(requests)))
+    seconds: float = time.perf_counter() - st
+    done.set()
+    pinger.join()
+    return {
+        "requests_per_second": requests / seconds,
+        "p50_ms": percentile(load_latencies, 0.5) * 1000,
+        "p99_ms": percentile(load_latencies, 0.99) * 1000,
+        "ping_p50_ms": percentile(ping_latencies, 0.5) * 1000,
+        "ping_p99_ms": percentile(ping_latencies, 0.99) * 1000,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="p50/p99 latency of /load-data/ under parallel load, blocking vs. async file I/O")
+    parser.add_argument("--clusters", type=int, default=20, help="summary and stats files per category")
+    parser.add_argument("--article-kb", type=int, default=20, help="approximate size of each article text")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="data requests per run")
+    parser.add_argument("--port", type=int, default=8011)
+    args = parser.parse_args()
+
+    import uvicorn
+    from fastapi_app import app, DirectoryPath, get_all_file_paths, read_json_file
+    from day_snapshot import get_snapshot_cache, SNAPSHOT_CACHE_MAX_DAYS
+
+    @app.get("/benchmark/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    @app.post("/benchmark/blocking-load-data/")
+    async def blocking_load_data(directory: DirectoryPath):
+        # The handler as it was: every file read and parsed on the event loop, on every request
+        return {
+            "msg": "We got data successfully",
+            "data": {
+                category: {
+                    section: [read_json_file(file_path) for file_path in
+                              get_all_file_paths(f"{directory.directory}/{directory.date}/{category}/{section}")]
+                    for section in ["summary", "stats"]
+                }
+                for category in ["business", "pakistan"]
+            }
+        }
+
+    server: uvicorn.Server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url: str = f"http://127.0.0.1:{args.port}"
+
+    rows: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as data_directory:
+        date: str = "2024-01-01"
+        make_day(data_directory, date, args.clusters, args.article_kb)
+        body: bytes = json.dumps({"directory": data_directory, "date": date}).encode("utf-8")
+        cases: List[Tuple[str, str, int]] = [
+            ("blocking", "/benchmark/blocking-load-data/", 0),
+            # Cache size 0 reloads the day on every request, isolating the thread pool from the snapshot cache
+            ("async-cold", "/load-data/", 0),
+            ("async-warm", "/load-data/", SNAPSHOT_CACHE_MAX_DAYS),
+        ]
+        for name, path, max_days in cases:
+            for concurrency in args.concurrency:
+                get_snapshot_cache().max_days = max_days
+                get_snapshot_cache().snapshots.clear()
+                rows.append({"case": name, "concurrency": concurrency,
+                             **run_load(base_url, path, body, concurrency, args.requests)})
+    server.should_exit = True
+
+    print("{:<11} {:>11} {:>8} {:>9} {:>9} {:>12} {:>12}".format(
+        "case", "concurrency", "req/s", "p50 ms", "p99 ms", "ping p50 ms", "ping p99 ms"))
+    for row in rows:
+        print("{:<11} {:>11} {:>8.1f} {:>9.1f} {:>9.1f} {:>12.1f} {:>12.1f}".format(
+            row["case"], row["concurrency"], row["requests_per_second"], row["p50_ms"], row["p99_ms"],
+            row["ping_p50_ms"], row["ping_p99_ms"]))
+
+if __name__ == "__main__":
+    main()
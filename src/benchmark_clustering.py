@@ -0,0 +1,192 @@
+import argparse
+import multiprocessing
+import resource
+import random
+import json
+import time
+import os
+import re
+from typing import Tuple, List, Any, Dict, Union
+
+SIZES: List[int] = [100, 1000, 10000, 100000]
+# name -> (clustering engine, embedding backend)
+ENGINES: Dict[str, Tuple[str, str]] = {
+    "transformers": ("transformers", "pytorch"),
+    "transformers-onnx": ("transformers", "onnx"),
+    "tfidf": ("tfidf", None),
+}
+NEWSGROUPS_CATEGORIES: List[str] = ["rec.sport.hockey", "sci.space", "talk.politics.guns"]
+SYNTHETIC_SOURCE_DIRECTORY: str = ".././data/2024-06-20/business"
+TOPIC_LABELS_NAME: str = "topic_labels.json"
+
+# A run is flagged as a regression if it is this much slower, or loses this much ARI, than the baseline
+TIME_REGRESSION_RATIO: float = 1.2
+ARI_REGRESSION_DELTA: float = 0.05
+
+def load_newsgroups_data(seed: int = 42):
+    from sklearn.datasets import fetch_20newsgroups
+
+    return fetch_20newsgroups(subset="all", categories=NEWSGROUPS_CATEGORIES,
+                              remove=("headers", "footers", "quotes"), random_state=seed)
+
+def load_newsgroups(size: int, seed: int = 42) -> Tuple[List[str], List[int]]:
+    newsgroups = load_newsgroups_data(seed)
+    if size > len(newsgroups.data):
+        raise ValueError(f"20newsgroups has only {len(newsgroups.data)} documents for {NEWSGROUPS_CATEGORIES}")
+    return list(newsgroups.data[:size]), list(newsgroups.target[:size])
+
+def load_labelled_articles(source_directory: str = SYNTHETIC_SOURCE_DIRECTORY) -> List[Tuple[str, int]]:
+    from k_means_cluster import fetch_and_merge_json_files
+
+    # Hand-assigned topics, not the pipeline's cluster files: those come from the transformers KMeans and would
+    # score every engine by its agreement with that one
+    with open(f"{source_directory}/{TOPIC_LABELS_NAME}", 'r', encoding='utf-8') as f:
+        topics: Dict[str, List[int]] = json.load(f)["topics"]
+    label_by_id: Dict[int, int] = {article_id: label for label, topic in enumerate(sorted(topics))
+                                   for article_id in topics[topic]}
+
+    return [(article["text"], label_by_id[int(article["id"])])
+            for article in fetch_and_merge_json_files(f"{source_directory}/articles")
+            if int(article["id"]) in label_by_id]
+
+def build_synthetic_corpus(size: int, seed: int = 42, keep_probability: float = 0.8) -> Tuple[List[str], List[int]]:
+    rng: random.Random = random.Random(seed)
+    labelled: List[Tuple[str, int]] = load_labelled_articles()
+
+    texts: List[str] = []
+    target: List[int] = []
+    for i in range(size):
+        text, label = labelled[i] if i < len(labelled) else rng.choice(labelled)
+        if i >= len(labelled):
+            # Beyond the real articles, emit variants that keep a random subset of the sentences
+            sentences: List[str] = re.split(r"(?<=[.!?])\s+", text)
+            kept: List[str] = [s for s in sentences if rng.random() < keep_probability]
+            text = " ".join(kept or sentences[:1])
+        texts.append(text)
+        target.append(label)
+    return texts, target
+
+def load_corpus(dataset: str, size: int) -> Tuple[List[str], List[int]]:
+    if dataset == "20newsgroups":
+        return load_newsgroups(size)
+    if dataset == "synthetic":
+        return build_synthetic_corpus(size)
+    raise ValueError(f"Unknown dataset: {dataset}")
+
+def run_case(dataset: str, size: int, engine_name: str) -> Dict[str, Any]:
+    import nltk
+    import pandas as pd
+    from sklearn.cluster import KMeans
+    from k_means_cluster import preprocess_text, get_cluster_embeddings, cluster_metrics
+
+    nltk.download('punkt', quiet=True)
+    nltk.download('stopwords', quiet=True)
+    engine, backend = ENGINES[engine_name]
+
+    texts, target = load_corpus(dataset, size)
+    df: pd.DataFrame = pd.DataFrame({"text": texts, "target": target})
+    rss_start: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    st: float = time.time()
+    df['text_cleaned'] = df['text'].apply(lambda text: preprocess_text(text))
+    df = df[df['text_cleaned'] != ''].copy()
+    preprocessing_seconds: float = time.time() - st
+
+    st = time.time()
+    embedding = get_cluster_embeddings(df, engine, backend)
+    embedding_seconds: float = time.time() - st
+
+    st = time.time()
+    n_clusters: int = len(set(target))
+    y_pred = KMeans(n_clusters=n_clusters, random_state=42).fit_predict(embedding)
+    clustering_seconds: float = time.time() - st
+
+    result: Dict[str, Any] = {
+        "dataset": dataset,
+        "size": size,
+        "engine": engine_name,
+        "documents": len(df),
+        "preprocessing_seconds": preprocessing_seconds,
+        "embedding_seconds": embedding_seconds,
+        "clustering_seconds": clustering_seconds,
+        # ru_maxrss is in KB on Linux; each case runs in its own process so this is the peak for this case only
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_increase_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / 1024,
+    }
+    result.update(cluster_metrics(df['target'], y_pred))
+    return result
+
+def run_isolated(dataset: str, size: int, engine_name: str) -> Dict[str, Any]:
+    # A fresh interpreter per case keeps peak memory and cached models from leaking between cases
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_case, (dataset, size, engine_name))
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    header: str = "{:<13} {:>7} {:<18} {:>9} {:>9} {:>9} {:>9} {:>6} {:>6} {:>6}".format(
+        "dataset", "size", "engine", "prep s", "embed s", "kmeans s", "peak MB", "ARI", "NMI", "FMI")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print("{:<13} {:>7} {:<18} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.0f} {:>6.3f} {:>6.3f} {:>6.3f}".format(
+            r["dataset"], r["size"], r["engine"], r["preprocessing_seconds"], r["embedding_seconds"],
+            r["clustering_seconds"], r["peak_rss_mb"], r["ari"], r["nmi"], r["fmi"]))
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline_path: str) -> List[str]:
+    with open(baseline_path, 'r') as file:
+        baseline: Dict[Tuple[str, int, str], Dict[str, Any]] = {
+            (r["dataset"], r["size"], r["engine"]): r for r in json.load(file)
+        }
+
+    regressions: List[str] = []
+    for r in results:
+        base: Dict[str, Any] = baseline.get((r["dataset"], r["size"], r["engine"]))
+        if not base:
+            continue
+        case: str = f'{r["dataset"]}/{r["size"]}/{r["engine"]}'
+        for stage in ["preprocessing_seconds", "embedding_seconds", "clustering_seconds"]:
+            if r[stage] > base[stage] * TIME_REGRESSION_RATIO:
+                regressions.append(f"{case}: {stage} {base[stage]:.2f} -> {r[stage]:.2f}")
+        if r["ari"] < base["ari"] - ARI_REGRESSION_DELTA:
+            regressions.append(f"{case}: ari {base['ari']:.3f} -> {r['ari']:.3f}")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark clustering engines for speed, memory and quality")
+    parser.add_argument("--datasets", nargs="+", default=["20newsgroups", "synthetic"], choices=["20newsgroups", "synthetic"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--engines", nargs="+", default=["transformers", "tfidf"], choices=list(ENGINES))
+    parser.add_argument("--output", help="write results as JSON, usable as a later --baseline")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for dataset in args.datasets:
+        sizes: List[int] = args.sizes
+        if dataset == "20newsgroups":
+            # The three-category subset is under 3k documents; larger sizes are dropped rather than padded with repeats
+            available: int = len(load_newsgroups_data().data)
+            sizes = [size for size in args.sizes if size <= available]
+            if len(sizes) < len(args.sizes):
+                print(f"20newsgroups: only {available} documents, dropping sizes "
+                      f"{', '.join(str(size) for size in args.sizes if size > available)}")
+        for size in sizes:
+            for engine_name in args.engines:
+                print(f"Running {dataset} / {size} / {engine_name}")
+                results.append(run_isolated(dataset, size, engine_name))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        regressions: List[str] = compare_with_baseline(results, args.baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
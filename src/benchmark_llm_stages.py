@@ -0,0 +1,97 @@
+import argparse
+import tempfile
+import asyncio
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+
+def replicate_clusters(clusters: List[Tuple[str, List[Dict[str, Any]]]], count: int) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    return [(str(i), clusters[i % len(clusters)][1]) for i in range(count)]
+
+def print_row(row: Dict[str, Any]) -> None:
+    print("{:<8} {:>11} {:>9} {:>12} {:>10} {:>10} {:>6} {:>8} {:>10} {:>9}".format(
+        row["stage"], row["concurrency"], row["completed"], "{:.2f}".format(row["clusters_per_second"]), "{:.1f}".format(row["seconds"]),
+        row["server_max_in_flight"], row["rate_limited"], row["retries"], "{:.1f}".format(row["backoff_seconds"]),
+        "{:.0f}%".format(row["retry_overhead"] * 100)))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the summary and stats stages against the local fake LLM server")
+    parser.add_argument("--clusters-directory", default=".././data/2024-06-21/business/clusters")
+    parser.add_argument("--clusters", type=int, default=20, help="clusters per run, replicated from the source day")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--requests-per-minute", type=int, default=600)
+    parser.add_argument("--tokens-per-minute", type=int, default=10000000)
+    parser.add_argument("--port", type=int, default=8002)
+    args = parser.parse_args()
+
+    # Module-level settings are read at import time, so configure the environment before importing the stages
+    os.environ["LLM_PROVIDER"] = "local"
+    os.environ["LOCAL_LLM_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ["LLM_REQUESTS_PER_MINUTE"] = str(args.requests_per_minute)
+    os.environ["LLM_TOKENS_PER_MINUTE"] = str(args.tokens_per_minute)
+
+    import fake_llm_server
+    from cluster_store import load_day_clusters
+    from llm_runner import new_runner_stats
+    from summarization import summarize_clusters_async
+    from stats import create_stats
+    from combined_extraction import extract_clusters_async
+    from cluster_packing import extract_packed_async
+
+    fake_llm_server.start_background_server(port=args.port, latency_seconds=args.latency, jitter_seconds=args.jitter,
+                                            tokens_per_second=args.tokens_per_second, error_rate=args.error_rate)
+    clusters: List[Tuple[str, List[Dict[str, Any]]]] = replicate_clusters(load_day_clusters(args.clusters_directory), args.clusters)
+
+    # stage -> runner(concurrency, runner stats, output directory); each returns cluster id -> result or exception
+    stages: List[Tuple[str, Any]] = [
+        ("summary", lambda concurrency, stats, directory: asyncio.run(summarize_clusters_async(
+            clusters, directory, max_concurrency=concurrency, mode="stuff", stats=stats))),
+        # Summary and stats from one call per cluster
+        ("combined", lambda concurrency, stats, directory: asyncio.run(extract_clusters_async(
+            clusters, os.path.join(directory, "combined_summary"), os.path.join(directory, "combined_stats"),
+            max_concurrency=concurrency, stats=stats))),
+        # Small clusters packed several to a request
+        ("packed", lambda concurrency, stats, directory: asyncio.run(extract_packed_async(
+            clusters, os.path.join(directory, "packed_summary"), os.path.join(directory, "packed_stats"),
+            max_concurrency=concurrency, stats=stats))),
+        ("stats", lambda concurrency, stats, directory: create_stats(
+            "benchmark", clusters, directory_path=os.path.join(directory, "stats"), max_concurrency=concurrency, stats=stats)),
+    ]
+
+    rows: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as output_directory:
+        for stage, run in stages:
+            for concurrency in args.concurrency:
+                fake_llm_server.reset_metrics()
+                stats: Dict[str, float] = new_runner_stats()
+                st: float = time.time()
+                results: Dict[str, Any] = run(concurrency, stats, output_directory)
+                seconds: float = time.time() - st
+                # Clusters that still failed after their retries do not count towards throughput
+                completed: int = sum(not isinstance(result, Exception) for result in results.values())
+                rows.append({
+                    "stage": stage,
+                    "concurrency": concurrency,
+                    "seconds": seconds,
+                    "completed": completed,
+                    "clusters_per_second": completed / seconds,
+                    "server_max_in_flight": fake_llm_server.metrics["max_in_flight"],
+                    "rate_limited": fake_llm_server.metrics["rate_limited"],
+                    "retries": stats["retries"],
+                    "backoff_seconds": stats["backoff_seconds"],
+                    # Share of the wall time spent sleeping before retries (summed over workers, so can exceed 100%)
+                    "retry_overhead": stats["backoff_seconds"] / seconds,
+                })
+
+    print("{:<8} {:>11} {:>9} {:>12} {:>10} {:>10} {:>6} {:>8} {:>10} {:>9}".format(
+        "stage", "concurrency", "completed", "clusters/s", "seconds", "in flight", "429s", "retries", "backoff s", "overhead"))
+    for row in rows:
+        print_row(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+import asyncio
+import json
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+from llm_runner import run_llm_tasks, estimate_tokens, new_runner_stats, RateLimiter, LLM_MAX_CONCURRENCY
+from llm_cache import get_llm_cache, content_hash, LLMCache
+from llm_provider import get_llm, get_model_name
+from combined_extraction import extract_clusters_async, format_articles, parse_combined_result, save_combined
+from stats_parser import repair_json
+
+# Clusters up to SMALL_CLUSTER_TOKENS are packed together into requests of at most PACK_TOKEN_BUDGET
+SMALL_CLUSTER_TOKENS: int = int(os.getenv("SMALL_CLUSTER_TOKENS", "3000"))
+PACK_TOKEN_BUDGET: int = int(os.getenv("PACK_TOKEN_BUDGET", "12000"))
+PACKED_PROMPT_VERSION: str = "packed-v1"
+CLUSTER_START: str = "### CLUSTER {id}"
+CLUSTER_END: str = "### END CLUSTER {id}"
+PACKED_SYSTEM_PROMPT: str = '''You are given several independent groups of news articles. Each group starts with a line "### CLUSTER <id>" and ends with "### END CLUSTER <id>". Handle every group on its own and never mix information between groups.
+                Return a single JSON object keyed by the cluster id, with one entry for every group and nothing else:
+                ```json
+                {{
+                    "<id>": {{
+                        "summary": "a concise summary of the group's articles in one or two paragraphs",
+                        "stats": [
+                            {{
+                                "object": "comprehensive and clear title of the object as well as mentioned the administrative unit if applicable",
+                                "headings": [],
+                                "data": []
+                            }}
+                        ]
+                    }}
+                }}
+                ```
+                For "stats", extract all statistical data from that group's articles. Ensure that every row in "data" has the same length as "headings" and that headings are consistent and standardized.
+                Only create high quality stats objects. If a group has no statistical data, its "stats" must be an empty list.'''
+
+def get_packed_chain():
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", PACKED_SYSTEM_PROMPT),
+            ("human", "{input}")
+        ]
+    )
+    return prompt | get_llm() | StrOutputParser()
+
+def pack_clusters(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]],
+                  token_budget: int = PACK_TOKEN_BUDGET) -> List[List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]]]:
+    # First-fit decreasing: largest clusters first, each into the first pack that still has room
+    packs: List[List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]]] = []
+    pack_tokens: List[int] = []
+    sized = sorted(((estimate_tokens(format_articles(meta)), id, meta) for id, meta in clusters), key=lambda item: -item[0])
+    for tokens, id, meta in sized:
+        for p in range(len(packs)):
+            if pack_tokens[p] + tokens <= token_budget:
+                packs[p].append((id, meta))
+                pack_tokens[p] += tokens
+                break
+        else:
+            packs.append([(id, meta)])
+            pack_tokens.append(tokens)
+    return packs
+
+def format_pack(pack: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]]) -> str:
+    return "\n\n".join(f"{CLUSTER_START.format(id=id)}\n{format_articles(meta)}\n{CLUSTER_END.format(id=id)}" for id, meta in pack)
+
+def split_packed_result(result: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    # Returns the clusters that came back well-formed; missing or malformed ones are left out
+    parsed: Any = json.loads(repair_json(result))
+    if not isinstance(parsed, dict):
+        raise ValueError("Packed result is not a JSON object")
+    split: Dict[str, Dict[str, Any]] = {}
+    for id in ids:
+        try:
+            split[id] = parse_combined_result(json.dumps(parsed[id]))
+        except (KeyError, ValueError, TypeError):
+            print(f"Packed result has no usable entry for cluster {id}")
+    return split
+
+async def extract_packed_async(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]], summary_directory_path: str,
+                               stats_directory_path: str, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                               stats: Dict[str, float] = None) -> Dict[str, Union[Dict[str, Any], Exception]]:
+    packed_chain = get_packed_chain()
+    model_name: str = get_model_name()
+    cache: Union[LLMCache, None] = get_llm_cache()
+    limiter: RateLimiter = RateLimiter()
+    stats = stats if stats is not None else new_runner_stats()
+    for directory_path in [summary_directory_path, stats_directory_path]:
+        if not os.path.exists(directory_path):
+            os.makedirs(directory_path, exist_ok=True)
+
+    results: Dict[str, Union[Dict[str, Any], Exception]] = {}
+    small_clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]] = []
+    large_clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]] = []
+    hashes: Dict[str, str] = {}
+    for id, meta in clusters:
+        if estimate_tokens(format_articles(meta)) > SMALL_CLUSTER_TOKENS:
+            large_clusters.append((id, meta))
+            continue
+        hashes[id] = content_hash(meta)
+        cached: Union[str, None] = cache.get("combined", model_name, PACKED_PROMPT_VERSION, hashes[id]) if cache else None
+        if cached is not None:
+            results[id] = json.loads(cached)
+            save_combined(summary_directory_path, stats_directory_path, id, results[id], meta)
+            continue
+        small_clusters.append((id, meta))
+
+    packs: List[List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]]] = pack_clusters(small_clusters)
+    print(f"{len(results)} small clusters served from cache, {len(small_clusters)} packed into {len(packs)} requests, "
+          f"{len(large_clusters)} large clusters sent one per request")
+
+    async def extract_pack(pack: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]]) -> Dict[str, Dict[str, Any]]:
+        split: Dict[str, Dict[str, Any]] = split_packed_result(await packed_chain.ainvoke({"input": format_pack(pack)}),
+                                                               [id for id, _ in pack])
+        for id, meta in pack:
+            if id in split:
+                if cache:
+                    cache.set("combined", model_name, PACKED_PROMPT_VERSION, hashes[id], json.dumps(split[id], ensure_ascii=False))
+                save_combined(summary_directory_path, stats_directory_path, id, split[id], meta)
+        return split
+
+    pack_tasks = [
+        (f"pack-{p}", estimate_tokens(format_pack(pack)), lambda pack=pack: extract_pack(pack))
+        for p, pack in enumerate(packs)
+    ]
+    pack_results, large_results = await asyncio.gather(
+        run_llm_tasks(pack_tasks, max_concurrency, limiter, stats),
+        extract_clusters_async(large_clusters, summary_directory_path, stats_directory_path, max_concurrency, stats, limiter),
+    )
+    results.update(large_results)
+
+    # Clusters a pack lost (failed request or missing from the response) are retried one per request
+    missing: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]] = []
+    for p, pack in enumerate(packs):
+        pack_result: Union[Dict[str, Dict[str, Any]], Exception] = pack_results[f"pack-{p}"]
+        for id, meta in pack:
+            if isinstance(pack_result, Exception) or id not in pack_result:
+                missing.append((id, meta))
+            else:
+                results[id] = pack_result[id]
+    if missing:
+        print(f"Retrying {len(missing)} clusters individually")
+        results.update(await extract_clusters_async(missing, summary_directory_path, stats_directory_path, max_concurrency, stats, limiter))
+
+    print(f"LLM requests: {stats['requests']} for {len(clusters)} clusters")
+    return results
+
+def get_save_packed_summary_and_stats(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]],
+                                      summary_directory_path: str, stats_directory_path: str) -> None:
+    st: float = time.time()
+    results: Dict[str, Union[Dict[str, Any], Exception]] = asyncio.run(
+        extract_packed_async(clusters, summary_directory_path, stats_directory_path))
+    failed: List[str] = [id for id, result in results.items() if isinstance(result, Exception)]
+    print(f"Extracted {len(results) - len(failed)} of {len(results)} clusters in {time.time() - st:.1f} seconds")
+    if failed:
+        print(f"Failed clusters: {failed}")
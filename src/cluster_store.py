@@ -0,0 +1,84 @@
+import pandas as pd
+import numpy as np
+from datetime import datetime
+import json
+import os
+from typing import Tuple, List, Any, Dict, Union
+
+MANIFEST_NAME: str = "manifest.json"
+MANIFEST_VERSION: int = 1
+RECORD_FIELDS: List[str] = ['id', 'datetime', 'title', 'authors', 'source', 'publish_date', 'url', 'text']
+
+def build_cluster_entry(cluster_id: int, df_cluster: pd.DataFrame) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {
+        "cluster_id": str(cluster_id),
+        "size": len(df_cluster),
+        "article_ids": [int(article_id) for article_id in df_cluster['id']],
+    }
+    if 'embedding' in df_cluster.columns:
+        centroid: np.ndarray = np.vstack(df_cluster['embedding']).mean(axis=0)
+        entry["centroid"] = [round(float(value), 6) for value in centroid]
+    return entry
+
+def save_cluster_store(directory_path: str, clusters: List[pd.DataFrame], category: str, today_date: datetime) -> str:
+    if not os.path.exists(directory_path):
+        os.makedirs(directory_path, exist_ok=True)
+
+    manifest: Dict[str, Any] = {
+        "version": MANIFEST_VERSION,
+        "date": str(today_date),
+        "category": category,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "clusters": [build_cluster_entry(cluster_id, df_cluster) for cluster_id, df_cluster in enumerate(clusters)],
+    }
+
+    # Write to a temporary file and rename so readers never see a half-written manifest
+    filename: str = os.path.join(directory_path, MANIFEST_NAME)
+    with open(f"{filename}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(f"{filename}.tmp", filename)
+
+    print(f"{len(clusters)} clusters saved to {filename}")
+    return filename
+
+def load_manifest(directory_path: str) -> Union[Dict[str, Any], None]:
+    filename: str = os.path.join(directory_path, MANIFEST_NAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def load_cluster_centroids(clusters_directory: str) -> Dict[str, List[float]]:
+    # Only the manifest is read, article texts are not touched
+    manifest: Union[Dict[str, Any], None] = load_manifest(clusters_directory)
+    if manifest is None:
+        return {}
+    return {entry["cluster_id"]: entry["centroid"] for entry in manifest["clusters"] if "centroid" in entry}
+
+def get_article_index(articles_directory: str) -> Dict[int, Dict[str, Any]]:
+    from k_means_cluster import fetch_and_merge_json_files
+
+    return {int(article['id']): article for article in fetch_and_merge_json_files(articles_directory) if 'id' in article}
+
+def load_day_clusters(clusters_directory: str) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    # Returns (cluster id, article records) for every cluster of the day
+    manifest: Union[Dict[str, Any], None] = load_manifest(clusters_directory)
+
+    if manifest is None:
+        # Days written before the manifest existed have one records file per cluster
+        clusters: List[Tuple[str, List[Dict[str, Any]]]] = []
+        for file in sorted(os.listdir(clusters_directory)):
+            if file.endswith('.json'):
+                with open(os.path.join(clusters_directory, file), 'r', encoding='utf-8') as f:
+                    clusters.append((file.split('.')[0], json.load(f)))
+        return clusters
+
+    articles: Dict[int, Dict[str, Any]] = get_article_index(os.path.join(os.path.dirname(os.path.normpath(clusters_directory)), "articles"))
+    return [
+        (
+            entry["cluster_id"],
+            [{key: articles[article_id][key] for key in RECORD_FIELDS if key in articles[article_id]}
+             for article_id in entry["article_ids"] if article_id in articles],
+        )
+        for entry in manifest["clusters"]
+    ]
@@ -0,0 +1,111 @@
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from dotenv import load_dotenv
+import asyncio
+import json
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+from llm_runner import run_llm_tasks, estimate_tokens, new_runner_stats, RateLimiter, LLM_MAX_CONCURRENCY
+from llm_cache import get_llm_cache, content_hash, LLMCache
+from llm_provider import get_llm, get_model_name
+from summarization import save_summary
+from stats_parser import repair_json, validate_stats_object
+
+load_dotenv()
+
+# "separate" sends every cluster twice (summary chain, then stats chain); "combined" gets both from one call;
+# "packed" also batches small clusters into shared requests (cluster_packing.py)
+LLM_EXTRACTION_MODE: str = os.getenv("LLM_EXTRACTION_MODE", "separate")
+COMBINED_PROMPT_VERSION: str = "combined-v1"
+COMBINED_SYSTEM_PROMPT: str = '''You are given news articles that cover the same story. Return a single JSON object with two keys and nothing else:
+                ```json
+                {{
+                    "summary": "a concise summary of the articles in one or two paragraphs",
+                    "stats": [
+                        {{
+                            "object": "comprehensive and clear title of the object as well as mentioned the administrative unit if applicable",
+                            "headings": [],
+                            "data": []
+                        }}
+                    ]
+                }}
+                ```
+                For "stats", extract all statistical data from the articles. Ensure that every row in "data" has the same length as "headings" and that headings are consistent and standardized. Do not repeat the same object.
+                Only create high quality stats objects and ignore less qualitative stats. If there is no statistical data, "stats" must be an empty list.'''
+
+def format_articles(records: List[Dict[str, Union[str, int, List[str]]]]) -> str:
+    return "\n\n".join(f"Article {c + 1}: {record.get('title', '')}\n{record['text']}" for c, record in enumerate(records))
+
+def get_combined_chain():
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", COMBINED_SYSTEM_PROMPT),
+            ("human", "{input}")
+        ]
+    )
+    return prompt | get_llm() | StrOutputParser()
+
+def parse_combined_result(result: str) -> Dict[str, Any]:
+    parsed: Dict[str, Any] = json.loads(repair_json(result))
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("summary"), str):
+        raise ValueError("Combined result has no summary")
+    stats: Any = parsed.get("stats") or []
+    stats = [obj for obj in (validate_stats_object(item) for item in stats) if obj is not None] if isinstance(stats, list) else []
+    return {"summary": parsed["summary"], "stats": stats}
+
+def save_stats(stats_directory_path: str, id: str, stats: List[Dict[str, Any]]) -> None:
+    with open(f'{stats_directory_path}/{id}.json', 'w', encoding='utf-8') as file:
+        json.dump(stats, file, ensure_ascii=False, indent=4)
+
+def save_combined(summary_directory_path: str, stats_directory_path: str, id: str,
+                  combined: Dict[str, Any], meta: List[Dict[str, Union[str, int, List[str]]]]) -> None:
+    # Same summary/ and stats/ files the separate stages write
+    save_summary(summary_directory_path, id, combined["summary"], meta)
+    if combined["stats"]:
+        save_stats(stats_directory_path, id, combined["stats"])
+
+async def extract_clusters_async(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]], summary_directory_path: str,
+                                 stats_directory_path: str, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                                 stats: Dict[str, float] = None, limiter: RateLimiter = None) -> Dict[str, Union[Dict[str, Any], Exception]]:
+    combined_chain = get_combined_chain()
+    model_name: str = get_model_name()
+    cache: Union[LLMCache, None] = get_llm_cache()
+    for directory_path in [summary_directory_path, stats_directory_path]:
+        if not os.path.exists(directory_path):
+            os.makedirs(directory_path, exist_ok=True)
+
+    async def extract(id: str, meta: List[Dict[str, Union[str, int, List[str]]]], cluster_hash: str, text: str) -> Dict[str, Any]:
+        combined: Dict[str, Any] = parse_combined_result(await combined_chain.ainvoke({"input": text}))
+        if cache:
+            cache.set("combined", model_name, COMBINED_PROMPT_VERSION, cluster_hash, json.dumps(combined, ensure_ascii=False))
+        save_combined(summary_directory_path, stats_directory_path, id, combined, meta)
+        return combined
+
+    results: Dict[str, Union[Dict[str, Any], Exception]] = {}
+    tasks = []
+    for id, meta in clusters:
+        cluster_hash: str = content_hash(meta)
+        cached: Union[str, None] = cache.get("combined", model_name, COMBINED_PROMPT_VERSION, cluster_hash) if cache else None
+        if cached is not None:
+            results[id] = json.loads(cached)
+            save_combined(summary_directory_path, stats_directory_path, id, results[id], meta)
+            continue
+        text: str = format_articles(meta)
+        tasks.append((id, estimate_tokens(text),
+                      lambda id=id, meta=meta, cluster_hash=cluster_hash, text=text: extract(id, meta, cluster_hash, text)))
+
+    print(f"{len(results)} clusters served from cache, {len(tasks)} sent to the LLM")
+    results.update(await run_llm_tasks(tasks, max_concurrency, limiter, stats))
+    return results
+
+def get_save_summary_and_stats(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]],
+                               summary_directory_path: str, stats_directory_path: str) -> None:
+    # One LLM call per cluster for both the summary and the stats
+    st: float = time.time()
+    results: Dict[str, Union[Dict[str, Any], Exception]] = asyncio.run(
+        extract_clusters_async(clusters, summary_directory_path, stats_directory_path))
+    failed: List[str] = [id for id, result in results.items() if isinstance(result, Exception)]
+    print(f"Extracted {len(results) - len(failed)} of {len(results)} clusters in {time.time() - st:.1f} seconds")
+    if failed:
+        print(f"Failed clusters: {failed}")
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable
+from day_snapshot import DaySnapshot, SnapshotCache, get_snapshot_cache, day_version, read_json_file
+from api_metrics import add_request_timing
+
+# Filesystem reads and JSON decoding run here so they never stall the event loop; bounded so a burst of
+# cold requests cannot open hundreds of files at once
+FILE_IO_WORKERS: int = int(os.getenv("FILE_IO_WORKERS", "8"))
+
+_executor: Union[ThreadPoolExecutor, None] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS, thread_name_prefix="file-io")
+    return _executor
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    # Time waiting for a free worker is reported apart from time running, for the slow-request breakdown
+    run_seconds: List[float] = [0.0]
+
+    def timed() -> Any:
+        started: float = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            run_seconds[0] = time.perf_counter() - started
+
+    st: float = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), timed)
+    finally:
+        add_request_timing("pool run", run_seconds[0])
+        add_request_timing("pool wait", time.perf_counter() - st - run_seconds[0])
+
+async def read_json_file_async(file_path: str) -> Any:
+    return await run_blocking(read_json_file, file_path)
+
+async def get_day_snapshot(data_directory: str, date: str, cache: SnapshotCache = None) -> DaySnapshot:
+    # Hits cost one stat in the pool and a dict lookup; misses load the whole day in the pool
+    cache = cache or get_snapshot_cache()
+    version: str = await run_blocking(day_version, data_directory, date)
+    snapshot: Union[DaySnapshot, None] = cache.peek(data_directory, date, version)
+    if snapshot is not None:
+        return snapshot
+    return await run_blocking(cache.get, data_directory, date)
@@ -0,0 +1,242 @@
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import argparse
+import hashlib
+import json
+import time
+import re
+import os
+from typing import Tuple, List, Any, Dict, Union
+from api_metrics import get_metrics
+
+DAY_MANIFEST_NAME: str = "day_manifest.json"
+CATEGORIES: List[str] = ["business", "pakistan"]
+SNAPSHOT_SECTIONS: List[str] = ["summary", "stats"]
+SNAPSHOT_CACHE_MAX_DAYS: int = int(os.getenv("SNAPSHOT_CACHE_MAX_DAYS", "7"))
+# Loader locks are striped over a fixed pool, so any number of requested (directory, date) keys costs no extra memory
+SNAPSHOT_LOCK_STRIPES: int = 64
+DATE_PATTERN: re.Pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+try:
+    # Several times faster than json on the large summary files, used when installed
+    import orjson
+
+    def json_loads(data: bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    def json_loads(data: bytes) -> Any:
+        return json.loads(data)
+
+def has_served_data(data_directory: str, date: str) -> bool:
+    return any(os.path.isdir(os.path.join(data_directory, date, category, section))
+               for category in CATEGORIES for section in SNAPSHOT_SECTIONS)
+
+def completed_days(data_directory: str) -> List[str]:
+    # Days the pipeline has finished, newest first; a day gets its manifest only after every category is written.
+    # Data written before manifests existed has none at all, so then every day with summaries or stats counts
+    if not os.path.isdir(data_directory):
+        return []
+    days: List[str] = sorted((date for date in os.listdir(data_directory) if DATE_PATTERN.match(date)), reverse=True)
+    manifested: List[str] = [date for date in days if os.path.exists(os.path.join(data_directory, date, DAY_MANIFEST_NAME))]
+    return manifested or [date for date in days if has_served_data(data_directory, date)]
+
+def list_json_files(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".json"))
+
+def file_signature(directory: str) -> List[Tuple[str, int, int]]:
+    return [(os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in list_json_files(directory)]
+
+def write_day_manifest(data_directory: str, date: str) -> str:
+    # Written by the pipeline once every category of the day is done; its version changes whenever any served file does
+    categories: Dict[str, Dict[str, int]] = {}
+    digest = hashlib.sha256()
+    for category in CATEGORIES:
+        categories[category] = {}
+        for section in SNAPSHOT_SECTIONS:
+            signature: List[Tuple[str, int, int]] = file_signature(os.path.join(data_directory, date, category, section))
+            categories[category][section] = len(signature)
+            digest.update(json.dumps([category, section, signature]).encode("utf-8"))
+
+    manifest: Dict[str, Any] = {
+        "date": date,
+        "version": digest.hexdigest()[:16],
+        "completed_at": datetime.now().isoformat(timespec="seconds"),
+        "categories": categories,
+    }
+    filename: str = os.path.join(data_directory, date, DAY_MANIFEST_NAME)
+    with open(f"{filename}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(f"{filename}.tmp", filename)
+    return filename
+
+def load_day_manifest(data_directory: str, date: str) -> Union[Dict[str, Any], None]:
+    filename: str = os.path.join(data_directory, date, DAY_MANIFEST_NAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def day_version(data_directory: str, date: str) -> str:
+    # Cheap enough to check on every request: one stat for the manifest, or one per served directory without it
+    manifest_path: str = os.path.join(data_directory, date, DAY_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        return f"manifest-{os.stat(manifest_path).st_mtime_ns}"
+    mtimes: List[str] = []
+    for category in CATEGORIES:
+        for section in SNAPSHOT_SECTIONS:
+            directory: str = os.path.join(data_directory, date, category, section)
+            mtimes.append(str(os.stat(directory).st_mtime_ns) if os.path.isdir(directory) else "-")
+    return f"mtime-{'-'.join(mtimes)}"
+
+def day_last_modified(data_directory: str, date: str) -> float:
+    manifest_path: str = os.path.join(data_directory, date, DAY_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        return os.stat(manifest_path).st_mtime
+    paths: List[str] = [os.path.join(data_directory, date, category, section) for category in CATEGORIES for section in SNAPSHOT_SECTIONS]
+    return max([os.stat(path).st_mtime for path in paths if os.path.isdir(path)], default=0.0)
+
+def cluster_sort_key(id: str) -> Tuple[int, str]:
+    return (len(id), id)
+
+def read_json_file(file_path: str) -> Any:
+    with open(file_path, 'rb') as file:
+        data: bytes = file.read()
+    get_metrics().increment("file_reads", "JSON files read from the data directory")
+    get_metrics().increment("file_read_bytes", "Bytes of JSON read from the data directory", len(data))
+    return json_loads(data)
+
+class DaySnapshot:
+    # Everything the API serves for one day, parsed once: {category: {section: {cluster id: file content}}}
+    def __init__(self, data_directory: str, date: str, version: str, files: Dict[str, Dict[str, Dict[str, Any]]]):
+        self.data_directory: str = data_directory
+        self.date: str = date
+        self.version: str = version
+        self.files: Dict[str, Dict[str, Dict[str, Any]]] = files
+        self.manifest: Union[Dict[str, Any], None] = load_day_manifest(data_directory, date)
+        self.loaded_at: float = time.time()
+        self.last_modified: float = day_last_modified(data_directory, date)
+        # Content version for HTTP validators: the manifest's file hash, or the mtime version for days without one
+        self.etag: str = self.manifest["version"] if self.manifest else hashlib.sha256(version.encode("utf-8")).hexdigest()[:16]
+
+    def payload(self) -> Dict[str, Dict[str, List[Any]]]:
+        # The shape POST /load-data/ has always returned
+        return {category: {section: list(self.files[category][section].values()) for section in SNAPSHOT_SECTIONS}
+                for category in self.files}
+
+    def cluster_ids(self, category: str) -> List[str]:
+        # Every cluster with a summary, in cluster order ("2" before "10")
+        return sorted(self.files[category]["summary"], key=cluster_sort_key)
+
+    def summary(self, category: str, id: str) -> Union[str, None]:
+        content: Union[Dict[str, Any], None] = self.files[category]["summary"].get(id)
+        return None if content is None else content.get("summary")
+
+    def meta_data(self, category: str, id: str) -> Union[List[Dict[str, Any]], None]:
+        # Article metadata without the full texts, which make up nearly all of a summary file
+        content: Union[Dict[str, Any], None] = self.files[category]["summary"].get(id)
+        if content is None:
+            return None
+        return [{key: value for key, value in meta.items() if key != "text"} for meta in content.get("meta_data", [])]
+
+    def stats(self, category: str, id: str) -> Union[List[Dict[str, Any]], None]:
+        return self.files[category]["stats"].get(id)
+
+    def counts(self, category: str) -> Dict[str, Any]:
+        return {
+            "summaries_count": len(self.files[category]["summary"]),
+            "meta_data_counts": [{"id": id, "len": len(self.files[category]["summary"][id].get("meta_data", []))}
+                                 for id in self.cluster_ids(category)],
+            "stats_count": len(self.files[category]["stats"]),
+        }
+
+def load_day_snapshot(data_directory: str, date: str) -> DaySnapshot:
+    # The version is read before the files, so a change made while loading is picked up by the next request
+    version: str = day_version(data_directory, date)
+    files: Dict[str, Dict[str, Dict[str, Any]]] = {
+        category: {
+            section: {os.path.splitext(os.path.basename(path))[0]: read_json_file(path)
+                      for path in list_json_files(os.path.join(data_directory, date, category, section))}
+            for section in SNAPSHOT_SECTIONS
+        }
+        for category in CATEGORIES
+    }
+    return DaySnapshot(data_directory, date, version, files)
+
+class SnapshotCache:
+    # Keeps the most recently used days in memory; a day is reloaded only when its version changes
+    def __init__(self, max_days: int = SNAPSHOT_CACHE_MAX_DAYS):
+        self.max_days: int = max_days
+        self.snapshots: "OrderedDict[Tuple[str, str], DaySnapshot]" = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.key_locks: List[threading.Lock] = [threading.Lock() for _ in range(SNAPSHOT_LOCK_STRIPES)]
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def peek(self, data_directory: str, date: str, version: str) -> Union[DaySnapshot, None]:
+        # Memory-only lookup for callers that already know the current version; never touches the disk
+        key: Tuple[str, str] = (os.path.normpath(data_directory), date)
+        with self.lock:
+            snapshot: Union[DaySnapshot, None] = self.snapshots.get(key)
+            if snapshot is None or snapshot.version != version:
+                return None
+            self.snapshots.move_to_end(key)
+            self.hits += 1
+            return snapshot
+
+    def get(self, data_directory: str, date: str) -> DaySnapshot:
+        snapshot: Union[DaySnapshot, None] = self.peek(data_directory, date, day_version(data_directory, date))
+        if snapshot is not None:
+            return snapshot
+        key: Tuple[str, str] = (os.path.normpath(data_directory), date)
+        key_lock: threading.Lock = self.key_locks[hash(key) % len(self.key_locks)]
+
+        # One loader per day; concurrent requests for the same day wait for it instead of all reading the disk
+        # (a day sharing the stripe waits too, which only delays it by one load)
+        with key_lock:
+            snapshot = self.peek(data_directory, date, day_version(data_directory, date))
+            if snapshot is not None:
+                return snapshot
+            snapshot = load_day_snapshot(data_directory, date)
+            with self.lock:
+                self.misses += 1
+            self.put(snapshot)
+            return snapshot
+
+    def put(self, snapshot: DaySnapshot) -> None:
+        # Replaces the day in one step; requests hold either the old snapshot or the new one
+        key: Tuple[str, str] = (os.path.normpath(snapshot.data_directory), snapshot.date)
+        with self.lock:
+            self.snapshots[key] = snapshot
+            self.snapshots.move_to_end(key)
+            while len(self.snapshots) > self.max_days:
+                self.snapshots.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"days": len(self.snapshots), "max_days": self.max_days, "hits": self.hits, "misses": self.misses}
+
+_snapshot_cache: Union[SnapshotCache, None] = None
+
+def get_snapshot_cache() -> SnapshotCache:
+    global _snapshot_cache
+    if _snapshot_cache is None:
+        _snapshot_cache = SnapshotCache()
+    return _snapshot_cache
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write day manifests for days completed before the pipeline wrote them")
+    parser.add_argument("--data-directory", default=os.getenv("DATA_DIRECTORY", ".././data"))
+    parser.add_argument("--date", help="YYYY-MM-DD, every day with summaries or stats and no manifest when omitted")
+    args = parser.parse_args()
+
+    dates: List[str] = [args.date] if args.date else sorted(
+        date for date in os.listdir(args.data_directory) if DATE_PATTERN.match(date) and has_served_data(args.data_directory, date)
+        and not os.path.exists(os.path.join(args.data_directory, date, DAY_MANIFEST_NAME)))
+    for date in dates:
+        print(f"{date}: {write_day_manifest(args.data_directory, date)}")
+
+if __name__ == "__main__":
+    main()
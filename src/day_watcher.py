@@ -0,0 +1,54 @@
+import asyncio
+import os
+from typing import Tuple, List, Any, Dict, Union
+from day_snapshot import DaySnapshot, SnapshotCache, get_snapshot_cache, completed_days, day_version, load_day_snapshot
+from data_access import run_blocking
+
+SNAPSHOT_WATCH_INTERVAL: float = float(os.getenv("SNAPSHOT_WATCH_INTERVAL", "30"))
+
+class DayWatcher:
+    # Polls for newly completed days and swaps the newest one in once it is fully loaded
+    def __init__(self, data_directory: str, interval: float = SNAPSHOT_WATCH_INTERVAL, cache: SnapshotCache = None):
+        self.data_directory: str = data_directory
+        self.interval: float = interval
+        self.cache: SnapshotCache = cache or get_snapshot_cache()
+        self.latest: Union[DaySnapshot, None] = None
+        self.swaps: int = 0
+        self.task: Union[asyncio.Task, None] = None
+
+    async def refresh(self) -> bool:
+        days: List[str] = await run_blocking(completed_days, self.data_directory)
+        if not days:
+            return False
+        version: str = await run_blocking(day_version, self.data_directory, days[0])
+        if self.latest is not None and self.latest.date == days[0] and self.latest.version == version:
+            return False
+        # Built in the file I/O pool, away from requests; published with a single assignment
+        snapshot: DaySnapshot = await run_blocking(load_day_snapshot, self.data_directory, days[0])
+        self.cache.put(snapshot)
+        self.latest = snapshot
+        self.swaps += 1
+        print(f"Serving {snapshot.date} (version {snapshot.etag}) as the latest day")
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                # Keep serving the previous day; the next poll tries again
+                print(f"Day watcher refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
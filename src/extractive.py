@@ -0,0 +1,104 @@
+import numpy as np
+import re
+from typing import Tuple, List, Any, Dict, Union
+from llm_runner import estimate_tokens
+
+SENTENCE_SPLIT_PATTERN: re.Pattern = re.compile(r"(?<=[.!?])\s+|\n+")
+# Sentences this similar to one already selected add nothing; the same story is often carried by several outlets
+REDUNDANCY_THRESHOLD: float = 0.9
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text or "") if sentence.strip()]
+
+def records_tokens(records: List[Dict[str, Union[str, int, List[str]]]]) -> int:
+    return sum(estimate_tokens(record["text"]) for record in records)
+
+def select_central_sentences(records: List[Dict[str, Union[str, int, List[str]]]], token_budget: int,
+                             centroid: List[float] = None) -> List[Dict[str, Union[str, int, List[str]]]]:
+    # Keeps the sentences closest to the cluster centroid until the token budget is used up, in their original order
+    from k_means_cluster import encode_texts
+
+    sentences: List[Tuple[int, int, str]] = [
+        (r, s, sentence) for r, record in enumerate(records) for s, sentence in enumerate(split_sentences(record["text"]))
+    ]
+    if not sentences:
+        return records
+
+    vectors: np.ndarray = encode_texts([sentence for _, _, sentence in sentences])
+    center: np.ndarray = np.asarray(centroid, dtype=np.float32) if centroid is not None else None
+    if center is None or center.shape[0] != vectors.shape[1]:
+        # No usable centroid (legacy day or TF-IDF engine): fall back to the mean of the sentence vectors
+        center = vectors.mean(axis=0)
+    center = center / max(np.linalg.norm(center), 1e-12)
+    scores: np.ndarray = vectors @ center
+
+    selected: List[int] = []
+    used_tokens: int = 0
+    for i in np.argsort(-scores):
+        tokens: int = estimate_tokens(sentences[i][2])
+        if used_tokens + tokens > token_budget:
+            continue
+        if selected and float(np.max(vectors[selected] @ vectors[i])) >= REDUNDANCY_THRESHOLD:
+            continue
+        selected.append(int(i))
+        used_tokens += tokens
+
+    kept: Dict[int, List[Tuple[int, str]]] = {}
+    for i in selected:
+        r, s, sentence = sentences[i]
+        kept.setdefault(r, []).append((s, sentence))
+
+    if not kept:
+        # Every sentence alone is over budget, keep the head of the first article
+        record: Dict[str, Union[str, int, List[str]]] = dict(records[0])
+        record["text"] = record["text"][:token_budget * 4]
+        return [record]
+
+    compressed: List[Dict[str, Union[str, int, List[str]]]] = []
+    for r in sorted(kept):
+        record: Dict[str, Union[str, int, List[str]]] = dict(records[r])
+        record["text"] = " ".join(sentence for _, sentence in sorted(kept[r]))
+        compressed.append(record)
+    return compressed
+
+def chunk_records(records: List[Dict[str, Union[str, int, List[str]]]], token_budget: int,
+                  centroid: List[float] = None) -> List[List[Dict[str, Union[str, int, List[str]]]]]:
+    # Packs whole articles into chunks of at most token_budget; a single article over budget is compressed first
+    chunks: List[List[Dict[str, Union[str, int, List[str]]]]] = []
+    chunk: List[Dict[str, Union[str, int, List[str]]]] = []
+    chunk_tokens: int = 0
+    for record in records:
+        tokens: int = estimate_tokens(record["text"])
+        if tokens > token_budget:
+            record = select_central_sentences([record], token_budget, centroid)[0]
+            tokens = estimate_tokens(record["text"])
+        if chunk and chunk_tokens + tokens > token_budget:
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(record)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# Digits, currency, percentages and magnitude words; sentences without any of these carry no figures for the stats stage
+NUMERIC_PATTERN: re.Pattern = re.compile(
+    r"\d|%|\$|\bRs\.?|\bPKR\b|\bUSD\b|\bper\s?cent\b|\b(?:hundred|thousand|million|billion|trillion|crore|lakh|lac|mln|bln)s?\b",
+    re.IGNORECASE,
+)
+
+def select_numeric_sentences(records: List[Dict[str, Union[str, int, List[str]]]],
+                             context: int = 1) -> List[Dict[str, Union[str, int, List[str]]]]:
+    # Keeps sentences with numeric content plus `context` neighbours on each side; articles with none are dropped
+    filtered: List[Dict[str, Union[str, int, List[str]]]] = []
+    for record in records:
+        sentences: List[str] = split_sentences(record["text"])
+        keep: set = set()
+        for s, sentence in enumerate(sentences):
+            if NUMERIC_PATTERN.search(sentence):
+                keep.update(range(max(s - context, 0), min(s + context + 1, len(sentences))))
+        if keep:
+            record = dict(record)
+            record["text"] = " ".join(sentences[s] for s in sorted(keep))
+            filtered.append(record)
+    return filtered
@@ -0,0 +1,145 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import threading
+import random
+import json
+import re
+import time
+from typing import Tuple, List, Any, Dict, Union
+
+CANNED_SUMMARY: str = (
+    "The Pakistan Stock Exchange extended its record rally as investors welcomed budget measures aimed at "
+    "securing a new IMF programme, while analysts cautioned that proposed tax changes could weigh on growth."
+)
+CANNED_STATS: List[Dict[str, Any]] = [
+    {
+        "object": "KSE-100 index closing levels, Pakistan Stock Exchange",
+        "headings": ["Date", "Close (points)", "Change (points)"],
+        "data": [["2024-06-20", "78,801.53", "+2,094.76"], ["2024-06-21", "80,000.00", "+1,198.47"]],
+    },
+    {
+        "object": "State Bank of Pakistan foreign exchange reserves",
+        "headings": ["Holder", "Reserves (US$ billion)"],
+        "data": [["State Bank of Pakistan", "9.1"], ["Commercial banks", "5.3"]],
+    },
+]
+
+# (marker found in the prompt, response) checked in order; the first match wins
+CANNED_RESPONSES: List[Tuple[str, str]] = [
+    ("Return a single JSON object with two keys", "```json\n" + json.dumps({"summary": CANNED_SUMMARY, "stats": CANNED_STATS}, indent=4) + "\n```"),
+    ("Extract all statistical data", "```json\n" + json.dumps(CANNED_STATS, indent=4) + "\n```"),
+    ("CONCISE SUMMARY", CANNED_SUMMARY),
+]
+
+config: Dict[str, float] = {
+    "latency_seconds": 1.0,
+    "jitter_seconds": 0.5,
+    "tokens_per_second": 100.0,
+    "error_rate": 0.0,
+    "max_concurrency": 0,
+}
+metrics: Dict[str, float] = {}
+metrics_lock: threading.Lock = threading.Lock()
+
+def reset_metrics() -> None:
+    with metrics_lock:
+        metrics.update({"requests": 0, "responses": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0,
+                        "prompt_tokens": 0, "completion_tokens": 0})
+
+def canned_response(prompt: str) -> str:
+    # Packed prompts get one summary/stats entry per "### CLUSTER <id>" block
+    packed_ids: List[str] = re.findall(r"^### CLUSTER (\S+)$", prompt, re.MULTILINE)
+    if packed_ids:
+        return "```json\n" + json.dumps({id: {"summary": CANNED_SUMMARY, "stats": CANNED_STATS} for id in packed_ids}, indent=4) + "\n```"
+    for marker, response in CANNED_RESPONSES:
+        if marker in prompt:
+            return response
+    return CANNED_SUMMARY
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        payload: bytes = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            with metrics_lock:
+                self.send_json(200, dict(metrics))
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/reset":
+            reset_metrics()
+            self.send_json(200, {"status": "ok"})
+            return
+        if self.path != "/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        prompt: str = json.loads(body)["prompt"]
+        with metrics_lock:
+            metrics["requests"] += 1
+            metrics["in_flight"] += 1
+            metrics["max_in_flight"] = max(metrics["max_in_flight"], metrics["in_flight"])
+            over_capacity: bool = bool(config["max_concurrency"]) and metrics["in_flight"] > config["max_concurrency"]
+        try:
+            if over_capacity or random.random() < config["error_rate"]:
+                with metrics_lock:
+                    metrics["rate_limited"] += 1
+                self.send_json(429, {"error": "Resource has been exhausted (e.g. check quota)."})
+                return
+
+            text: str = canned_response(prompt)
+            completion_tokens: int = len(text) // 4 + 1
+            # Fixed time to first token, then generation at tokens_per_second
+            time.sleep(config["latency_seconds"] + random.random() * config["jitter_seconds"]
+                       + completion_tokens / config["tokens_per_second"])
+            with metrics_lock:
+                metrics["responses"] += 1
+                metrics["prompt_tokens"] += len(prompt) // 4 + 1
+                metrics["completion_tokens"] += completion_tokens
+            self.send_json(200, {"text": text})
+        finally:
+            with metrics_lock:
+                metrics["in_flight"] -= 1
+
+def make_server(host: str = "127.0.0.1", port: int = 8002, **overrides: float) -> ThreadingHTTPServer:
+    config.update(overrides)
+    reset_metrics()
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), FakeLLMHandler)
+    server.daemon_threads = True
+    return server
+
+def start_background_server(host: str = "127.0.0.1", port: int = 8002, **overrides: float) -> ThreadingHTTPServer:
+    server: ThreadingHTTPServer = make_server(host, port, **overrides)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the LLM API with canned summary and stats responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=config["latency_seconds"], help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=config["jitter_seconds"], help="random extra latency, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=config["tokens_per_second"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="fraction of requests answered with 429")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="answer 429 above this many in-flight requests, 0 for no limit")
+    args = parser.parse_args()
+
+    server: ThreadingHTTPServer = make_server(args.host, args.port, latency_seconds=args.latency, jitter_seconds=args.jitter,
+                                              tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                                              max_concurrency=args.max_concurrency)
+    print(f"Fake LLM server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,58 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
 from glob import glob
 from datetime import datetime
 import json
+import time
+from data_access import get_day_snapshot
+from day_snapshot import CATEGORIES, DATE_PATTERN, cluster_sort_key, get_snapshot_cache
+from day_watcher import DayWatcher
+from data_access import run_blocking
+from news_index import get_news_index
+from vector_index import get_vector_index, embed_query
+from rag_qa import get_qa_service, get_qa_stats
+from http_cache import conditional_response, cached_json_response, add_compression
+from response_cache import get_response_cache
+from api_metrics import MetricsMiddleware, get_metrics
 
 
 
 app = FastAPI()
+add_compression(app)
+# Added after compression so it wraps it: latencies cover the whole stack and sizes are the bytes actually sent
+app.add_middleware(MetricsMiddleware)
 
 data = {}
+# The GET routes serve the pipeline's own data directory, paged to at most MAX_PAGE_SIZE clusters
+DATA_DIRECTORY = os.getenv("DATA_DIRECTORY", ".././data")
+MAX_PAGE_SIZE = 100
+day_watcher = DayWatcher(DATA_DIRECTORY)
+
+metrics = get_metrics()
+metrics.add_collector("snapshot_cache", "Parsed days held in memory", lambda: get_snapshot_cache().stats())
+metrics.add_collector("response_cache", "Serialized response bodies", lambda: get_response_cache().stats())
+metrics.add_collector("day_watcher", "Background reloads of the newest day", lambda: {"swaps": day_watcher.swaps})
+metrics.add_collector("vector_index", "Memory-mapped FAISS shards", lambda: {"open_shards": len(get_vector_index().shards)})
+metrics.add_collector("qa", "Question answering caches", get_qa_stats)
+
+@app.on_event("startup")
+async def start_day_watcher():
+    # The newest completed day is loaded before the first request, then kept current in the background
+    try:
+        await day_watcher.refresh()
+    except Exception as e:
+        print(f"Initial day load failed: {e}")
+    day_watcher.start()
+    # Opening the news index can re-index every day after a schema change; done here, off the event loop, so the
+    # first range or search request does not block the server on it
+    await run_blocking(get_news_index)
+
+@app.on_event("shutdown")
+async def stop_day_watcher():
+    await day_watcher.stop()
 
 def get_all_file_paths(directory: str) -> List[str]:
     file_paths = []
@@ -32,121 +74,183 @@ class DirectoryPath(BaseModel):
     date: str
 
 @app.post("/load-data/")
-async def load_data(directory: DirectoryPath):
+async def load_data(request: Request, directory: DirectoryPath):
     data_directory = directory.directory
     date = directory.date
 
-    data = {
-        "business": {
-            "summary": [read_json_file(file_path) for file_path in get_all_file_paths(f"{data_directory}/{date}/business/summary")],
-            "stats": [read_json_file(file_path) for file_path in get_all_file_paths(f"{data_directory}/{date}/business/stats")]
-        },
-        "pakistan": {
-            "summary": [read_json_file(file_path) for file_path in get_all_file_paths(f"{data_directory}/{date}/pakistan/summary")],
-            "stats": [read_json_file(file_path) for file_path in get_all_file_paths(f"{data_directory}/{date}/pakistan/stats")]
-        }
-    }
-
-    return {
-        "msg": "We got data successfully",
-        "data": data
-    }
-
-# @app.get("/health")
-# async def health_check():
-#     return {"status": "ok"}
-
-# @app.get("/summaries/{category}/all")
-# async def get_summaries(category: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     summaries = {}
-#     for summary_path in data[category]["summary"]:
-#         file_name = os.path.basename(summary_path)
-#         file_id = os.path.splitext(file_name)[0]
-#         with open(summary_path, 'r', encoding='utf-8') as file:
-#             summary = json.load(file)
-#             summaries[file_id] = summary["summary"]
-#     return {"summaries": summaries, "len": len(summaries)}
-
-# @app.get("/summaries/{category}/{summary_id}")
-# async def get_summary_by_id(category: str, summary_id: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     summary_path = f".././data/{datetime.now().strftime('%Y-%m-%d')}/{category}/summary/{summary_id}.json"
-#     if not os.path.exists(summary_path):
-#         raise HTTPException(status_code=404, detail="Summary not found")
-#     with open(summary_path, 'r', encoding='utf-8') as file:
-#         summary = json.load(file)
-#     return {"summary": summary["summary"]}
-
-# @app.get("/meta_data/{category}/all")
-# async def get_meta_data(category: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     meta_data = {}
-#     for meta_data_path in data[category]["summary"]:
-#         file_name = os.path.basename(meta_data_path)
-#         file_id = os.path.splitext(file_name)[0]
-#         with open(meta_data_path, 'r', encoding='utf-8') as file:
-#             meta = json.load(file)
-#             meta_data[file_id] = meta["meta_data"]
-#     return {"meta_data": meta_data, "len": len(meta_data)}
-
-# @app.get("/meta_data/{category}/{meta_id}")
-# async def get_meta_data_by_id(category: str, meta_id: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     meta_data_path = f".././data/{datetime.now().strftime('%Y-%m-%d')}/{category}/summary/{meta_id}.json"
-#     if not os.path.exists(meta_data_path):
-#         raise HTTPException(status_code=404, detail="Meta data not found")
-#     with open(meta_data_path, 'r', encoding='utf-8') as file:
-#         meta_data = json.load(file)
-#     return {"meta_data": meta_data["meta_data"]}
-
-# @app.get("/stats/{category}/all")
-# async def get_stats(category: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     stats = []
-#     for stats_path in data[category]["stats"]:
-#         with open(stats_path, 'r', encoding='utf-8') as file:
-#             stat = json.load(file)
-#             stats.append(stat)
-#     return {"stats": stats}
-
-# @app.get("/stats/{category}/{stat_id}")
-# async def get_stat_by_id(category: str, stat_id: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     stats_path = f".././data/{datetime.now().strftime('%Y-%m-%d')}/{category}/stats/{stat_id}.json"
-#     if not os.path.exists(stats_path):
-#         raise HTTPException(status_code=404, detail="Stat not found")
-#     with open(stats_path, 'r', encoding='utf-8') as file:
-#         stat = json.load(file)
-#     return {"stat": stat}
+    # Parsed once per day and version, repeated requests are served from memory; disk work runs off the event loop
+    try:
+        snapshot = await get_day_snapshot(data_directory, date)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading data for {date}: {str(e)}")
 
-# @app.get("/counts/{category}")
-# async def get_counts(category: str):
-#     if category not in data:
-#         raise HTTPException(status_code=404, detail="Category not found")
-#     summary_count = len(data[category]["summary"])
-#     stats_count = len(data[category]["stats"])
-    
-#     # Count the number of objects in each meta_data file
-#     meta_data_counts = []
-#     for meta_data_path in data[category]["summary"]:
-#         file_name = os.path.basename(meta_data_path)
-#         file_id = os.path.splitext(file_name)[0]
-#         with open(meta_data_path, 'r', encoding='utf-8') as file:
-#             meta = json.load(file)
-#             meta_data_counts.append({"id": file_id, "len": len(meta["meta_data"])})
-    
-#     return {
-#         "summaries_count": summary_count,
-#         "meta_data_counts": meta_data_counts,
-#         "stats_count": stats_count
-#     }
+    # The full day is the largest body the API sends; it is encoded once per day version
+    key = (os.path.normpath(snapshot.data_directory), snapshot.date, snapshot.version, "load-data")
+    return await cached_json_response(request, key, lambda: {
+        "msg": "We got data successfully",
+        "data": snapshot.payload()
+    })
+
+async def get_category_snapshot(category: str, date: Optional[str]):
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    if category not in CATEGORIES:
+        raise HTTPException(status_code=404, detail="Category not found")
+    if date == "latest":
+        return get_latest_snapshot()
+    if not DATE_PATTERN.match(date):
+        raise HTTPException(status_code=400, detail="Date must be YYYY-MM-DD or latest")
+    try:
+        return await get_day_snapshot(DATA_DIRECTORY, date)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error loading data for {date}: {str(e)}")
+
+def get_latest_snapshot():
+    snapshot = day_watcher.latest
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No completed day yet")
+    return snapshot
+
+def paginate(ids: List[str], offset: int, limit: int) -> Dict[str, Any]:
+    return {"total": len(ids), "offset": offset, "limit": limit, "ids": ids[offset:offset + limit]}
+
+@app.get("/health")
+async def health_check():
+    return {"status": "ok"}
+
+@app.get("/latest")
+async def get_latest(request: Request):
+    # Newest day the pipeline has completed; the other GET routes serve it with ?date=latest
+    snapshot = get_latest_snapshot()
+    return await conditional_response(request, snapshot, lambda: {
+        "date": snapshot.date,
+        "version": snapshot.etag,
+        "completed_at": snapshot.manifest.get("completed_at") if snapshot.manifest else None,
+        "counts": {category: snapshot.counts(category) for category in CATEGORIES},
+    })
+
+@app.get("/summaries/{category}/all")
+async def get_summaries(request: Request, category: str, date: Optional[str] = None,
+                        offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    snapshot = await get_category_snapshot(category, date)
+    page = paginate(snapshot.cluster_ids(category), offset, limit)
+    ids = page.pop("ids")
+    return await conditional_response(request, snapshot, lambda: {
+        "summaries": {id: snapshot.summary(category, id) for id in ids}, "len": len(ids), **page})
+
+@app.get("/summaries/{category}/{summary_id}")
+async def get_summary_by_id(request: Request, category: str, summary_id: str, date: Optional[str] = None):
+    snapshot = await get_category_snapshot(category, date)
+    summary = snapshot.summary(category, summary_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Summary not found")
+    return await conditional_response(request, snapshot, lambda: {"summary": summary})
+
+@app.get("/meta_data/{category}/all")
+async def get_meta_data(request: Request, category: str, date: Optional[str] = None,
+                        offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    snapshot = await get_category_snapshot(category, date)
+    page = paginate(snapshot.cluster_ids(category), offset, limit)
+    ids = page.pop("ids")
+    return await conditional_response(request, snapshot, lambda: {
+        "meta_data": {id: snapshot.meta_data(category, id) for id in ids}, "len": len(ids), **page})
+
+@app.get("/meta_data/{category}/{meta_id}")
+async def get_meta_data_by_id(request: Request, category: str, meta_id: str, date: Optional[str] = None):
+    snapshot = await get_category_snapshot(category, date)
+    meta_data = snapshot.meta_data(category, meta_id)
+    if meta_data is None:
+        raise HTTPException(status_code=404, detail="Meta data not found")
+    return await conditional_response(request, snapshot, lambda: {"meta_data": meta_data})
+
+@app.get("/stats/{category}/all")
+async def get_stats(request: Request, category: str, date: Optional[str] = None,
+                    offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    snapshot = await get_category_snapshot(category, date)
+    # Paged over the clusters that have stats, not every cluster
+    page = paginate(sorted(snapshot.files[category]["stats"], key=cluster_sort_key), offset, limit)
+    ids = page.pop("ids")
+    return await conditional_response(request, snapshot, lambda: {
+        "stats": {id: snapshot.stats(category, id) for id in ids}, "len": len(ids), **page})
+
+@app.get("/stats/{category}/{stat_id}")
+async def get_stat_by_id(request: Request, category: str, stat_id: str, date: Optional[str] = None):
+    snapshot = await get_category_snapshot(category, date)
+    stat = snapshot.stats(category, stat_id)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Stat not found")
+    return await conditional_response(request, snapshot, lambda: {"stat": stat})
+
+@app.get("/counts/{category}")
+async def get_counts(request: Request, category: str, date: Optional[str] = None):
+    snapshot = await get_category_snapshot(category, date)
+    return await conditional_response(request, snapshot, lambda: snapshot.counts(category))
+
+def check_date_range(start_date: Optional[str], end_date: Optional[str]) -> None:
+    for value in [start_date, end_date]:
+        if value and not DATE_PATTERN.match(value):
+            raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+
+@app.get("/range/summaries")
+async def get_range_summaries(start_date: Optional[str] = None, end_date: Optional[str] = None, category: Optional[str] = None,
+                              source: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    # Multi-day queries go to the index database instead of the per-day directories
+    check_date_range(start_date, end_date)
+    return await run_blocking(get_news_index().query_summaries, start_date, end_date, category, source, offset, limit)
+
+@app.get("/range/articles")
+async def get_range_articles(start_date: Optional[str] = None, end_date: Optional[str] = None, category: Optional[str] = None,
+                             source: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    check_date_range(start_date, end_date)
+    return await run_blocking(get_news_index().query_articles, start_date, end_date, category, source, offset, limit)
+
+@app.get("/range/stats")
+async def get_range_stats(start_date: Optional[str] = None, end_date: Optional[str] = None, category: Optional[str] = None,
+                          source: Optional[str] = None, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    check_date_range(start_date, end_date)
+    return await run_blocking(get_news_index().query_stats, start_date, end_date, category, source, offset, limit)
+
+@app.get("/search")
+async def search(q: str = Query(..., min_length=1), kind: str = Query("all", pattern="^(all|articles|summaries)$"),
+                 start_date: Optional[str] = None, end_date: Optional[str] = None, category: Optional[str] = None,
+                 match: str = Query("all", pattern="^(all|any)$"), limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    # BM25 over article titles and texts and over cluster summaries; lower scores rank higher
+    check_date_range(start_date, end_date)
+    st = time.perf_counter()
+    results = await run_blocking(get_news_index().search, q, kind, start_date, end_date, category, limit, match == "all")
+    return {"query": q, "took_ms": round((time.perf_counter() - st) * 1000, 2), "results": results}
+
+@app.get("/semantic-search")
+async def semantic_search(q: str = Query(..., min_length=1), start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          category: Optional[str] = None, limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE)):
+    # Articles closest in meaning to the query (cosine score, best first), across every date shard in range
+    check_date_range(start_date, end_date)
+    st = time.perf_counter()
+    query_vector = await run_blocking(embed_query, q)
+    results = await run_blocking(get_vector_index().search, query_vector, start_date, end_date, category, limit)
+    return {"query": q, "took_ms": round((time.perf_counter() - st) * 1000, 2), "results": results}
+
+class Question(BaseModel):
+    question: str
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    category: Optional[str] = None
+
+@app.post("/qa")
+async def answer_question(question: Question):
+    # Answers from the articles closest to the question; repeated and near-identical questions skip the LLM
+    if not question.question.strip():
+        raise HTTPException(status_code=400, detail="Question must not be empty")
+    check_date_range(question.start_date, question.end_date)
+    return await get_qa_service().answer(question.question, question.start_date, question.end_date, question.category)
+
+@app.get("/metrics")
+async def get_prometheus_metrics():
+    # Prometheus text format; counters are per worker process, so scrape each worker or sum them
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/sources")
+async def get_sources():
+    return {"sources": await run_blocking(get_news_index().sources)}
 
 if __name__ == "__main__":
     import uvicorn
@@ -247,7 +351,7 @@ if __name__ == "__main__":
 #     return {"summaries": summaries, "len": len(summaries)}
 
 # @app.get("/summaries/{category}/{summary_id}")
-# async def get_summary_by_id(category: str, summary_id: str):
+# async def get_summary_by_id(request: Request, category: str, summary_id: str):
 #     if category not in data:
 #         raise HTTPException(status_code=404, detail="Category not found")
 #     summary_path = f"{data_directory}/{datetime.now().strftime('%Y-%m-%d')}/{category}/summary/{summary_id}.json"
@@ -271,7 +375,7 @@ if __name__ == "__main__":
 #     return {"meta_data": meta_data, "len": len(meta_data)}
 
 # @app.get("/meta_data/{category}/{meta_id}")
-# async def get_meta_data_by_id(category: str, meta_id: str):
+# async def get_meta_data_by_id(request: Request, category: str, meta_id: str):
 #     if category not in data:
 #         raise HTTPException(status_code=404, detail="Category not found")
 #     meta_data_path = f"{data_directory}/{datetime.now().strftime('%Y-%m-%d')}/{category}/summary/{meta_id}.json"
@@ -293,7 +397,7 @@ if __name__ == "__main__":
 #     return {"stats": stats}
 
 # @app.get("/stats/{category}/{stat_id}")
-# async def get_stat_by_id(category: str, stat_id: str):
+# async def get_stat_by_id(request: Request, category: str, stat_id: str):
 #     if category not in data:
 #         raise HTTPException(status_code=404, detail="Category not found")
 #     stats_path = f"{data_directory}/{datetime.now().strftime('%Y-%m-%d')}/{category}/stats/{stat_id}.json"
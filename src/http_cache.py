@@ -0,0 +1,93 @@
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, Response
+import hashlib
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable
+from day_snapshot import DaySnapshot
+from response_cache import CachedBody, get_response_cache, serialize
+from data_access import run_blocking
+
+# Clients and CDNs may store responses but must revalidate, since today's data changes until the pipeline finishes
+CACHE_CONTROL: str = "public, no-cache"
+
+def make_etag(snapshot: DaySnapshot, request: Request) -> str:
+    # Same day version and same URL means the same body. Weak, because compression changes the bytes on the wire
+    digest: str = hashlib.sha256(f"{request.url.path}?{sorted(request.query_params.multi_items())}".encode("utf-8")).hexdigest()[:16]
+    return f'W/"{snapshot.etag}-{digest}"'
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    if_none_match: Union[str, None] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2); comparison is weak
+        candidates: List[str] = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag.removeprefix("W/") in candidates
+    if_modified_since: Union[str, None] = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def validator_headers(snapshot: DaySnapshot, request: Request) -> Dict[str, str]:
+    return {
+        "ETag": make_etag(snapshot, request),
+        "Last-Modified": formatdate(snapshot.last_modified, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+def accepts_gzip(request: Request) -> bool:
+    # Parsed per coding with its q-value: "gzip;q=0" refuses gzip, "*" covers it unless gzip is listed itself
+    qualities: Dict[str, float] = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        quality: float = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    gzip_quality: Union[float, None] = qualities.get("gzip", qualities.get("x-gzip"))
+    return (gzip_quality if gzip_quality is not None else qualities.get("*", 0.0)) > 0
+
+def raw_json_response(request: Request, entry: CachedBody, headers: Dict[str, str]) -> Response:
+    # The stored bytes go out as they are; the compression middleware passes bodies with a Content-Encoding through
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if entry.gzipped is not None and accepts_gzip(request):
+        return Response(entry.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+async def cached_json_response(request: Request, key: Tuple[Any, ...], build: Callable[[], Any],
+                               headers: Dict[str, str] = None) -> Response:
+    cache = get_response_cache()
+    entry: Union[CachedBody, None] = cache.get(key)
+    if entry is None:
+        # Large bodies take a while to encode and compress, so misses run in the file I/O pool. Not get_or_build,
+        # which would look the key up again and count this miss twice
+        entry = await run_blocking(lambda: serialize(build()))
+        cache.set(key, entry)
+    return raw_json_response(request, entry, headers or {})
+
+async def conditional_response(request: Request, snapshot: DaySnapshot, build: Union[Callable[[], Any], Any]) -> Response:
+    # 304 without building anything when the client already has this version of the response; otherwise the body
+    # is serialized once per day version and URL and served from memory after that
+    headers: Dict[str, str] = validator_headers(snapshot, request)
+    if is_not_modified(request, headers["ETag"], snapshot.last_modified):
+        return Response(status_code=304, headers=headers)
+    key: Tuple[Any, ...] = (os.path.normpath(snapshot.data_directory), snapshot.date, headers["ETag"])
+    return await cached_json_response(request, key, build if callable(build) else lambda: build, headers)
+
+def add_compression(app: Any, minimum_size: int = 1000) -> str:
+    # Brotli when brotli-asgi is installed (it falls back to gzip for clients without br), gzip otherwise
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError:
+        from fastapi.middleware.gzip import GZipMiddleware
+        app.add_middleware(GZipMiddleware, minimum_size=minimum_size)
+        return "gzip"
+    app.add_middleware(BrotliMiddleware, minimum_size=minimum_size, gzip_fallback=True)
+    return "br"
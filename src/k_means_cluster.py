@@ -7,7 +7,9 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score, fowlkes_mallows_score
 from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.preprocessing import Normalizer
+from scipy.sparse import csr_matrix
 import matplotlib.pyplot as plt
 from datetime import datetime
 import seaborn as sns
@@ -16,8 +18,21 @@ import numpy as np
 import time
 import json
 import os
+from functools import lru_cache
 from typing import Tuple, List, Any, Dict, Union
+from cluster_store import save_cluster_store
+from vector_index import save_day_vectors
 
+# "pytorch" runs sentence-transformers, "onnx" runs the int8-quantized export from onnx_embeddings.py
+EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "pytorch")
+# "transformers" clusters sentence embeddings, "tfidf" clusters sparse TF-IDF reduced with TruncatedSVD (LSA)
+CLUSTERING_ENGINE: str = os.getenv("CLUSTERING_ENGINE", "transformers")
+LSA_COMPONENTS: int = int(os.getenv("LSA_COMPONENTS", "100"))
+
+@lru_cache(maxsize=1)
+def get_stopwords() -> frozenset:
+    # stopwords.words() re-reads the corpus file on every call, so build the set once
+    return frozenset(stopwords.words("english"))
 
 def preprocess_text(text: str) -> str:
     # Ensure text is a string
@@ -30,7 +45,8 @@ def preprocess_text(text: str) -> str:
 
     # remove stopwords
     tokens: str = nltk.word_tokenize(text)
-    tokens: List[str] = [w for w in tokens if not w.lower() in stopwords.words("english")]
+    english_stopwords: frozenset = get_stopwords()
+    tokens: List[str] = [w for w in tokens if not w.lower() in english_stopwords]
     text: str = " ".join(tokens)
     text: str = text.lower().strip()
 
@@ -77,12 +93,46 @@ def fetch_and_merge_json_files(directory: str) -> List[Dict[str, Union[str, int,
 
     return merged_data
 
-def tfidvectorizer_embeddings(df: pd.DataFrame) -> None:
-    vectorizer: TfidfVectorizer = TfidfVectorizer(sublinear_tf=True, min_df=5, max_df=0.95)
-    X: np.ndarray = vectorizer.fit_transform(df['text_cleaned']).toarray()
+def tfidvectorizer_embeddings(df: pd.DataFrame) -> csr_matrix:
+    # Re-clustering an oversized cluster only has a handful of documents, where min_df=5 would drop every term
+    n_docs: int = len(df)
+    min_df: int = 5 if n_docs >= 50 else 1
+    max_df: float = 0.95 if n_docs >= 20 else 1.0
+    vectorizer: TfidfVectorizer = TfidfVectorizer(sublinear_tf=True, min_df=min_df, max_df=max_df)
+    X: csr_matrix = vectorizer.fit_transform(df['text_cleaned'])
+    return X
+
+def lsa_embeddings(df: pd.DataFrame, n_components: int = LSA_COMPONENTS) -> np.ndarray:
+    st: float = time.time()
+
+    X_tfidf: csr_matrix = tfidvectorizer_embeddings(df)
+    # TruncatedSVD works on the sparse matrix directly, only the reduced (n_docs x n_components) output is dense
+    n_components = max(2, min(n_components, X_tfidf.shape[0] - 1, X_tfidf.shape[1] - 1))
+    svd: TruncatedSVD = TruncatedSVD(n_components=n_components, random_state=42)
+    X_lsa: np.ndarray = svd.fit_transform(X_tfidf)
+    X_lsa = Normalizer(copy=False).fit_transform(X_lsa)
+
+    et: float = time.time()
+
+    print("Elapsed time: {:.2f} seconds".format(et - st))
+    print("LSA explained variance: {:.1f}%".format(svd.explained_variance_ratio_.sum() * 100))
+    return X_lsa
+
+@lru_cache(maxsize=1)
+def get_sentence_transformer() -> SentenceTransformer:
+    # Loaded once per process instead of on every (re-)clustering pass
+    return SentenceTransformer('all-MiniLM-L6-v2')
+
+def encode_texts(texts: List[str], backend: str = None) -> np.ndarray:
+    # Unit-length all-MiniLM-L6-v2 vectors for arbitrary texts (sentences, queries) in the clustering space
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        from onnx_embeddings import onnx_encode
+        return onnx_encode(texts)
+    return get_sentence_transformer().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
 
 def sentance_transformers_embeddings(df: pd.DataFrame) -> np.ndarray:
-    model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2')
+    model: SentenceTransformer = get_sentence_transformer()
     st: float = time.time()
 
     # Assuming `model` is initialized somewhere in your code
@@ -95,6 +145,27 @@ def sentance_transformers_embeddings(df: pd.DataFrame) -> np.ndarray:
     X_transformers: np.ndarray = np.vstack(df['encode_transforemers'])
     return X_transformers
 
+def onnx_runtime_embeddings(df: pd.DataFrame) -> np.ndarray:
+    # Imported here so onnxruntime is only needed on hosts that select the onnx backend
+    from onnx_embeddings import onnx_encode
+    st: float = time.time()
+
+    X_transformers: np.ndarray = onnx_encode(df['text_cleaned'].tolist())
+    df['encode_transforemers'] = list(X_transformers)
+
+    et: float = time.time()
+
+    print("Elapsed time: {:.2f} seconds".format(et - st))
+    return X_transformers
+
+def get_embeddings(df: pd.DataFrame, backend: str = None) -> np.ndarray:
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "pytorch":
+        return sentance_transformers_embeddings(df)
+    if backend == "onnx":
+        return onnx_runtime_embeddings(df)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
 # def fetch_today_file(directory):
 #     # Get today's date in YYYY-MM-DD format
 #     today_date = datetime.now().strftime("%Y-%m-%d")
@@ -116,19 +187,24 @@ def sentance_transformers_embeddings(df: pd.DataFrame) -> np.ndarray:
 
 
 
-def eval_cluster(embedding, target):
-    kmeans = KMeans(n_clusters=3, random_state=42)
+def cluster_metrics(target, y_pred) -> Dict[str, float]:
+    # Evaluate the performance using ARI, NMI, and FMI
+    return {
+        "ari": adjusted_rand_score(target, y_pred),
+        "nmi": normalized_mutual_info_score(target, y_pred),
+        "fmi": fowlkes_mallows_score(target, y_pred),
+    }
+
+def eval_cluster(embedding, target, n_clusters: int = 3):
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
     y_pred = kmeans.fit_predict(embedding)
     
-    # Evaluate the performance using ARI, NMI, and FMI
-    ari = adjusted_rand_score(target, y_pred)
-    nmi = normalized_mutual_info_score(target, y_pred)
-    fmi = fowlkes_mallows_score(target, y_pred)
+    metrics: Dict[str, float] = cluster_metrics(target, y_pred)
 
     # Print Metrics scores
-    print("Adjusted Rand Index (ARI): {:.3f}".format(ari))
-    print("Normalized Mutual Information (NMI): {:.3f}".format(nmi))
-    print("Fowlkes-Mallows Index (FMI): {:.3f}".format(fmi))
+    print("Adjusted Rand Index (ARI): {:.3f}".format(metrics["ari"]))
+    print("Normalized Mutual Information (NMI): {:.3f}".format(metrics["nmi"]))
+    print("Fowlkes-Mallows Index (FMI): {:.3f}".format(metrics["fmi"]))
     
     return y_pred
 
@@ -178,15 +254,25 @@ def plot_pca(df, x0_name, x1_name, cluster_name, method):
     
 #     print(f"Data saved to {filename}")
 
-def get_clustered_dataframe(all_articles_json_list: list[Dict[str, Union[str, int, List[str]]]]) -> pd.DataFrame:
+def get_cluster_embeddings(df: pd.DataFrame, engine: str = None, backend: str = None) -> np.ndarray:
+    engine = engine or CLUSTERING_ENGINE
+    if engine == "transformers":
+        return get_embeddings(df, backend)
+    if engine == "tfidf":
+        return lsa_embeddings(df)
+    raise ValueError(f"Unknown clustering engine: {engine}")
+
+def get_clustered_dataframe(all_articles_json_list: list[Dict[str, Union[str, int, List[str]]]], engine: str = None) -> pd.DataFrame:
 
     df: pd.DataFrame = pd.DataFrame.from_records(all_articles_json_list)
     #df = pd.read_json(today_file_path)
     df['text_cleaned'] = df['text'].apply(lambda text: preprocess_text(text))
     df = df[df['text_cleaned'] != '']
-    X_transformers: np.ndarray = sentance_transformers_embeddings(df)
+    X_transformers: np.ndarray = get_cluster_embeddings(df, engine)
     kmeans: KMeans = KMeans(n_clusters=3, random_state=42)
     clusters: np.ndarray = kmeans.fit_predict(X_transformers)
+    df['embedding'] = list(X_transformers)
+    # Column name is kept for every engine, get_clusters_list reads it
     clusters_result_name: str = 'cluster_transformers'
     df[clusters_result_name] = clusters
     dimension_reduction(df, X_transformers, 'transformers')
@@ -195,50 +281,50 @@ def get_clustered_dataframe(all_articles_json_list: list[Dict[str, Union[str, in
     
     return df
 
-def get_clusters_list(df: pd.DataFrame, category: str, today_date: datetime) -> List[List[Dict[str, str]]]:
-    columns_to_keep: List[str] = ['id', 'datetime','title', 'authors', 'publish_date', 'url', 'text_cleaned']
-    rename_columns: Dict[str, str] = {'text_cleaned': 'text'}
-    
-    clusters_list: List = []
+def get_clusters_list(df: pd.DataFrame) -> Tuple[List[pd.DataFrame], List[List[Dict[str, Union[str, int, List[str]]]]]]:
+    # Columns added by get_clustered_dataframe; oversized clusters are re-clustered from the article fields only
+    derived_columns: List[str] = ['text_cleaned', 'encode_transforemers', 'embedding', 'cluster_transformers',
+                                  'x0_transformers', 'x1_transformers']
+
+    final_clusters: List[pd.DataFrame] = []
+    limit_exceeded_clusters: List[List[Dict[str, Union[str, int, List[str]]]]] = []
     for cluster in [0, 1, 2]:
-        df_cluster = df[df['cluster_transformers'] == cluster]
-        df_cluster = df_cluster[columns_to_keep].rename(columns=rename_columns)
-
-        json_data: str = df_cluster.to_json(orient='records', indent=4)
-        json_objects_list: List[Dict[str: str]] = json.loads(json_data)
-        
-        if len(json_objects_list) <= 15:
-            directory_path: str = f'.././data/{today_date}/{category}/clusters'
-            if not os.path.exists(directory_path):
-                os.makedirs(directory_path)
-            file_no: int = get_next_file_number(directory_path)
-            filename: str = f'{directory_path}/{file_no}.json'
-
-            if not os.path.exists(directory_path):
-                os.makedirs(directory_path, exist_ok=True)
-
-            with open(filename, 'w') as file:
-                file.write(json_data)
-            
-            print(f"Data saved to {filename}")
+        df_cluster: pd.DataFrame = df[df['cluster_transformers'] == cluster]
+        if df_cluster.empty:
+            continue
 
+        if len(df_cluster) <= 15:
+            final_clusters.append(df_cluster)
         else:
-            clusters_list.append(json_objects_list)
+            limit_exceeded_clusters.append(df_cluster.drop(columns=derived_columns, errors='ignore').to_dict('records'))
     
-    return clusters_list
+    return final_clusters, limit_exceeded_clusters
+
+def article_vectors(df_cluster: pd.DataFrame) -> np.ndarray:
+    # Sentence vectors for semantic search; the clustering vectors are reused unless they are LSA ones
+    if CLUSTERING_ENGINE == "transformers":
+        return np.vstack(df_cluster['embedding'])
+    return encode_texts(df_cluster['text_cleaned'].tolist())
 
 def process_clusters(category: str, today_date: datetime) -> None:
     all_articles_json_list: list[Dict[str, Union[str, int, List[str]]]] = fetch_and_merge_json_files(f".././data/{today_date}/{category}/articles")
     df: pd.DataFrame = get_clustered_dataframe(all_articles_json_list)
-    limit_exceeded_clusters: List[List[Dict[str: str]]] = get_clusters_list(df, category, today_date)
+    final_clusters, limit_exceeded_clusters = get_clusters_list(df)
     
     while limit_exceeded_clusters:
         new_clusters: List = []
         for cluster_json in limit_exceeded_clusters:
             df: pd.DataFrame = get_clustered_dataframe(cluster_json)
-            new_clusters.extend(get_clusters_list(df, category, today_date))
+            clusters, oversized_clusters = get_clusters_list(df)
+            final_clusters.extend(clusters)
+            new_clusters.extend(oversized_clusters)
         limit_exceeded_clusters = new_clusters
 
+    # All of the day's clusters are written in one pass, as a manifest of article ids
+    save_cluster_store(f".././data/{today_date}/{category}/clusters", final_clusters, category, today_date)
+    save_day_vectors(f".././data/{today_date}/{category}/vectors", final_clusters,
+                     [article_vectors(df_cluster) for df_cluster in final_clusters])
+
 
 def main() -> None:
     today_date: datetime = datetime.now().strftime("%Y-%m-%d")
@@ -251,7 +337,8 @@ if __name__ == "__main__":
     columns_to_keep: List[str] = ['title', 'authors', 'source', 'publish_date', 'url', 'text_cleaned']
     rename_columns: Dict[str, str] = {'text_cleaned': 'text'}
 
-    model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2')
+    if CLUSTERING_ENGINE == "transformers":
+        model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2')
     nltk.download('punkt')
     nltk.download('stopwords')
 
@@ -0,0 +1,137 @@
+import argparse
+import hashlib
+import sqlite3
+import json
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+
+LLM_CACHE_PATH: str = os.getenv("LLM_CACHE_PATH", ".././data/llm_cache.sqlite")
+LLM_CACHE_MAX_BYTES: int = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+
+def content_hash(records: List[Dict[str, Union[str, int, List[str]]]]) -> str:
+    # Hash of the article texts the LLM sees; sorted so a cluster with the same articles in another order still hits
+    digest = hashlib.sha256()
+    for text in sorted(record["text"] for record in records):
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def make_cache_key(namespace: str, model: str, prompt_version: str, cluster_hash: str) -> str:
+    return hashlib.sha256("\0".join([namespace, model, prompt_version, cluster_hash]).encode("utf-8")).hexdigest()
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        directory: str = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+        self.connection.commit()
+
+    def get(self, namespace: str, model: str, prompt_version: str, cluster_hash: str) -> Union[str, None]:
+        key: str = make_cache_key(namespace, model, prompt_version, cluster_hash)
+        row: Union[Tuple[str], None] = self.connection.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.connection.commit()
+        return row[0]
+
+    def set(self, namespace: str, model: str, prompt_version: str, cluster_hash: str, value: str) -> None:
+        key: str = make_cache_key(namespace, model, prompt_version, cluster_hash)
+        now: float = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, namespace, model, prompt_version, value, len(value.encode("utf-8")), now, now),
+        )
+        self.connection.commit()
+        self.evict()
+
+    def total_bytes(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def evict(self) -> int:
+        # Drop least recently used entries until the cache is back under 90% of its size limit
+        total: int = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        evicted: int = 0
+        target: int = int(self.max_bytes * 0.9)
+        for key, size in self.connection.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall():
+            if total <= target:
+                break
+            self.connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self.connection.commit()
+        return evicted
+
+    def invalidate(self, namespace: str = None, model: str = None, prompt_version: str = None) -> int:
+        conditions: List[str] = []
+        params: List[str] = []
+        for column, value in [("namespace", namespace), ("model", model), ("prompt_version", prompt_version)]:
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where: str = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        deleted: int = self.connection.execute(f"DELETE FROM llm_cache{where}", params).rowcount
+        self.connection.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        rows: List[Tuple[str, int, int]] = self.connection.execute(
+            "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache GROUP BY namespace").fetchall()
+        return {
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "total_bytes": sum(size for _, _, size in rows),
+            "namespaces": {namespace: {"entries": count, "bytes": size} for namespace, count, size in rows},
+        }
+
+_llm_cache: Union[LLMCache, None] = None
+
+def get_llm_cache() -> Union[LLMCache, None]:
+    # Shared per process; None when caching is switched off with LLM_CACHE_ENABLED=0
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the LLM result cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="show entries and size per namespace")
+    clear_parser = subparsers.add_parser("clear", help="delete cached results, all of them unless filtered")
+    clear_parser.add_argument("--namespace", help="e.g. summary or stats")
+    clear_parser.add_argument("--model")
+    clear_parser.add_argument("--prompt-version")
+    args = parser.parse_args()
+
+    cache: LLMCache = LLMCache()
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=4))
+    elif args.command == "clear":
+        deleted: int = cache.invalidate(args.namespace, args.model, args.prompt_version)
+        print(f"Deleted {deleted} cached results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.language_models.llms import LLM
+from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from dotenv import load_dotenv
+import urllib.request
+import urllib.error
+import asyncio
+import json
+import os
+from typing import Tuple, List, Any, Dict, Union, Optional
+
+load_dotenv()
+
+# "google" (Gemini, the default), "openai", or "local" for the stand-in server in fake_llm_server.py
+LLM_PROVIDER: str = os.getenv("LLM_PROVIDER", "google")
+LOCAL_LLM_URL: str = os.getenv("LOCAL_LLM_URL", "http://127.0.0.1:8002")
+MODEL_NAMES: Dict[str, str] = {
+    "google": "gemini-1.5-flash-latest",
+    "openai": "gpt-4o",
+    "local": "local-fake",
+}
+
+class LocalLLMError(Exception):
+    pass
+
+class LocalLLM(LLM):
+    base_url: str = LOCAL_LLM_URL
+    model: str = MODEL_NAMES["local"]
+    timeout: float = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "local"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        request: urllib.request.Request = urllib.request.Request(
+            f"{self.base_url}/generate",
+            data=json.dumps({"prompt": prompt, "model": self.model}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())["text"]
+        except urllib.error.HTTPError as e:
+            # Keep the status code in the message, llm_runner retries on "429"
+            raise LocalLLMError(f"{e.code} {e.reason}") from e
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None,
+                     run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        return await asyncio.to_thread(self._call, prompt, stop)
+
+def get_model_name(provider: str = None) -> str:
+    return MODEL_NAMES[provider or LLM_PROVIDER]
+
+def get_llm(provider: str = None) -> BaseLanguageModel:
+    provider = provider or LLM_PROVIDER
+    if provider == "google":
+        from langchain_google_genai import GoogleGenerativeAI
+        return GoogleGenerativeAI(temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"), model=MODEL_NAMES["google"])
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(openai_api_key=os.getenv("OPENAI_API_KEY"), temperature=0, model_name=MODEL_NAMES["openai"])
+    if provider == "local":
+        return LocalLLM()
+    raise ValueError(f"Unknown LLM provider: {provider}")
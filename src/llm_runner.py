@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable, Awaitable
+
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_REQUESTS_PER_MINUTE: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "15"))
+LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS: float = 2.0
+BACKOFF_MAX_SECONDS: float = 60.0
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English prose; only used for rate limiting
+    return len(text) // 4 + 1
+
+class RateLimiter:
+    # Two token buckets refilled continuously: one for requests, one for LLM tokens per minute
+    def __init__(self, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
+        self.requests_per_minute: int = requests_per_minute
+        self.tokens_per_minute: int = tokens_per_minute
+        self.available_requests: float = requests_per_minute
+        self.available_tokens: float = tokens_per_minute
+        self.updated_at: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now: float = time.monotonic()
+        elapsed_minutes: float = (now - self.updated_at) / 60
+        self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed_minutes * self.requests_per_minute)
+        self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed_minutes * self.tokens_per_minute)
+        self.updated_at = now
+
+    async def acquire(self, tokens: int) -> None:
+        # A single prompt larger than the whole minute budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                wait_minutes: float = max((1 - self.available_requests) / self.requests_per_minute,
+                                          (tokens - self.available_tokens) / self.tokens_per_minute)
+                await asyncio.sleep(max(wait_minutes * 60, 0.01))
+
+def is_rate_limit_error(error: Exception) -> bool:
+    message: str = str(error).lower()
+    return ("429" in message or "rate limit" in message or "quota" in message
+            or type(error).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"))
+
+def new_runner_stats() -> Dict[str, float]:
+    return {"requests": 0, "retries": 0, "failures": 0, "backoff_seconds": 0.0, "in_flight": 0, "max_in_flight": 0}
+
+async def run_with_retry(call: Callable[[], Awaitable[Any]], limiter: RateLimiter, tokens: int,
+                         stats: Dict[str, float], max_retries: int = LLM_MAX_RETRIES) -> Any:
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(tokens)
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            return await call()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            # Exponential backoff with full jitter, so parallel workers don't retry in lockstep
+            delay: float = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+            stats["retries"] += 1
+            stats["backoff_seconds"] += delay
+            print(f"Rate limited, retrying in {delay:.1f} seconds (attempt {attempt + 1} of {max_retries})")
+        finally:
+            stats["in_flight"] -= 1
+        await asyncio.sleep(delay)
+
+async def run_llm_tasks(tasks: List[Tuple[str, int, Callable[[], Awaitable[Any]]]],
+                        max_concurrency: int = LLM_MAX_CONCURRENCY,
+                        limiter: RateLimiter = None,
+                        stats: Dict[str, float] = None) -> Dict[str, Union[Any, Exception]]:
+    # tasks are (key, estimated tokens, coroutine factory); returns key -> result, or the exception if it failed
+    limiter = limiter or RateLimiter()
+    stats = stats if stats is not None else new_runner_stats()
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(key: str, tokens: int, call: Callable[[], Awaitable[Any]]) -> Tuple[str, Union[Any, Exception]]:
+        async with semaphore:
+            try:
+                return key, await run_with_retry(call, limiter, tokens, stats)
+            except Exception as e:
+                stats["failures"] += 1
+                print(f"LLM call for {key} failed: {e}")
+                return key, e
+
+    results: List[Tuple[str, Union[Any, Exception]]] = await asyncio.gather(*(run_one(*task) for task in tasks))
+    return dict(results)
@@ -32,6 +32,12 @@ from extra_files.news_tool_scraper import *
 from k_means_cluster import *
 from summarization import *
 from stats import *
+from combined_extraction import *
+from cluster_packing import *
+from stats_warehouse import StatsWarehouse
+from day_snapshot import write_day_manifest
+from news_index import NewsIndex
+from vector_index import VectorIndex
 
 
 if __name__ == "__main__":
@@ -43,7 +49,8 @@ if __name__ == "__main__":
     columns_to_keep = ['title', 'authors', 'source', 'publish_date', 'url', 'text_cleaned']
     rename_columns = {'text_cleaned': 'text'}
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    if CLUSTERING_ENGINE == "transformers":
+        model = SentenceTransformer('all-MiniLM-L6-v2')
     nltk.download('punkt')
     nltk.download('stopwords')
 
@@ -60,8 +67,28 @@ if __name__ == "__main__":
 
         process_clusters(category, today_date)
 
-        clusters_directory_path = get_all_file_paths(f".././data/{today_date}/{category}/clusters")
+        clusters_directory = f".././data/{today_date}/{category}/clusters"
+        clusters = load_day_clusters(clusters_directory)
         summary_directory_path = f'.././data/{today_date}/{category}/summary'
-        get_save_summary_stats(clusters_directory_path, summary_directory_path)
+        if LLM_EXTRACTION_MODE == "combined":
+            get_save_summary_and_stats(clusters, summary_directory_path, f'.././data/{today_date}/{category}/stats')
+        elif LLM_EXTRACTION_MODE == "packed":
+            get_save_packed_summary_and_stats(clusters, summary_directory_path, f'.././data/{today_date}/{category}/stats')
+        else:
+            get_save_summary_stats(clusters, summary_directory_path, load_cluster_centroids(clusters_directory))
 
-        create_stats(category, clusters_directory_path)
\ No newline at end of file
+            create_stats(category, clusters)
+
+    # Cross-day stats queries read the warehouse instead of the per-cluster JSON files
+    warehouse = StatsWarehouse()
+    print(f"Stats warehouse: {warehouse.ingest_day(today_date)} values loaded for {today_date}")
+    warehouse.close()
+
+    # Date-range and source queries in the API read the index instead of walking day directories
+    # A new or migrated index is rebuilt from every day, today included, instead of holding today alone
+    news_index = NewsIndex()
+    print(f"News index: {news_index.rebuild_if_migrated('.././data') or news_index.index_day(today_date, '.././data')}")
+    print(f"Vector index: {VectorIndex().build_day(today_date, '.././data')} vectors in the shard holding {today_date}")
+
+    # Marks the day complete; the API reloads its in-memory copy when the manifest changes
+    write_day_manifest(".././data", today_date)
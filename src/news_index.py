@@ -0,0 +1,271 @@
+import argparse
+import threading
+import sqlite3
+import json
+import re
+import os
+from typing import Tuple, List, Any, Dict, Union
+from day_snapshot import CATEGORIES, DATE_PATTERN, list_json_files, read_json_file
+
+NEWS_INDEX_PATH: str = os.getenv("NEWS_INDEX_PATH", ".././data/news_index.sqlite")
+DATA_DIRECTORY: str = os.getenv("DATA_DIRECTORY", ".././data")
+
+# Bump when the schema changes; an index with another version is dropped and rebuilt from the data directory
+SCHEMA_VERSION: int = 2
+SCHEMA: List[str] = [
+    """CREATE TABLE IF NOT EXISTS clusters (
+        rowid INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        cluster_id TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        summary TEXT,
+        UNIQUE (date, category, cluster_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS articles (
+        rowid INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        cluster_id TEXT NOT NULL,
+        title TEXT,
+        authors TEXT,
+        source TEXT,
+        publish_date TEXT,
+        url TEXT,
+        text TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS stats (
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        cluster_id TEXT NOT NULL,
+        object_index INTEGER NOT NULL,
+        object TEXT NOT NULL,
+        headings TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (date, category, cluster_id, object_index)
+    )""",
+    "CREATE INDEX IF NOT EXISTS articles_date_category ON articles (date, category)",
+    "CREATE INDEX IF NOT EXISTS articles_source_date ON articles (source, date)",
+    "CREATE INDEX IF NOT EXISTS articles_cluster ON articles (date, category, cluster_id)",
+    "CREATE INDEX IF NOT EXISTS articles_url ON articles (url)",
+    # Full-text indexes over article titles and texts and over cluster summaries, kept in step by triggers
+    """CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+        title, text, content='articles', content_rowid='rowid', tokenize='porter unicode61')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS clusters_fts USING fts5(
+        summary, content='clusters', content_rowid='rowid', tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+        INSERT INTO articles_fts (rowid, title, text) VALUES (new.rowid, new.title, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, text) VALUES ('delete', old.rowid, old.title, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS clusters_fts_insert AFTER INSERT ON clusters BEGIN
+        INSERT INTO clusters_fts (rowid, summary) VALUES (new.rowid, new.summary);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS clusters_fts_delete AFTER DELETE ON clusters BEGIN
+        INSERT INTO clusters_fts (clusters_fts, rowid, summary) VALUES ('delete', old.rowid, old.summary);
+    END""",
+]
+INDEX_TABLES: List[str] = ["clusters", "articles", "stats", "articles_fts", "clusters_fts"]
+SNIPPET_TOKENS: int = 16
+
+def fts_query(query: str, match_all: bool = True) -> str:
+    # User text becomes quoted terms, so punctuation and FTS operators in it cannot break the query
+    terms: List[str] = re.findall(r"\w+", query)
+    return (" " if match_all else " OR ").join(f'"{term}"' for term in terms)
+
+def day_rows(data_directory: str, date: str) -> Dict[str, List[Tuple[Any, ...]]]:
+    # Clusters and their articles come from the summary files (the summary plus the records it was made from)
+    rows: Dict[str, List[Tuple[Any, ...]]] = {"clusters": [], "articles": [], "stats": []}
+    for category in CATEGORIES:
+        for path in list_json_files(os.path.join(data_directory, date, category, "summary")):
+            cluster_id: str = os.path.splitext(os.path.basename(path))[0]
+            content: Dict[str, Any] = read_json_file(path)
+            meta_data: List[Dict[str, Any]] = content.get("meta_data", [])
+            rows["clusters"].append((date, category, cluster_id, len(meta_data), content.get("summary")))
+            for meta in meta_data:
+                authors: Any = meta.get("authors")
+                rows["articles"].append((date, category, cluster_id, meta.get("title"),
+                                         ", ".join(authors) if isinstance(authors, list) else authors,
+                                         meta.get("source"), str(meta.get("publish_date") or ""), meta.get("url"), meta.get("text")))
+        for path in list_json_files(os.path.join(data_directory, date, category, "stats")):
+            cluster_id = os.path.splitext(os.path.basename(path))[0]
+            stats: Any = read_json_file(path)
+            for object_index, obj in enumerate(stats if isinstance(stats, list) else []):
+                if isinstance(obj, dict):
+                    rows["stats"].append((date, category, cluster_id, object_index, str(obj.get("object", "")),
+                                          json.dumps(obj.get("headings", []), ensure_ascii=False),
+                                          json.dumps(obj.get("data", []), ensure_ascii=False)))
+    return rows
+
+def build_filters(start_date: str = None, end_date: str = None, category: str = None, source: str = None,
+                  table: str = "articles") -> Tuple[str, List[Any]]:
+    conditions: List[str] = []
+    params: List[Any] = []
+    for condition, param in [(f"{table}.date >= ?", start_date), (f"{table}.date <= ?", end_date), (f"{table}.category = ?", category)]:
+        if param:
+            conditions.append(condition)
+            params.append(param)
+    if source:
+        if table == "articles":
+            conditions.append("articles.source = ?")
+        else:
+            # A cluster matches a source when any of its articles came from it
+            conditions.append(f"""EXISTS (SELECT 1 FROM articles WHERE articles.date = {table}.date AND articles.category = {table}.category
+                                   AND articles.cluster_id = {table}.cluster_id AND articles.source = ?)""")
+        params.append(source)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+class NewsIndex:
+    def __init__(self, path: str = NEWS_INDEX_PATH):
+        directory: str = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path: str = path
+        # One connection per thread, so the API's file I/O pool can read in parallel under WAL
+        self.local: threading.local = threading.local()
+        connection: sqlite3.Connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Also true for a new file, whose user_version starts at 0; callers rebuild with rebuild_if_migrated
+        self.migrated: bool = connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION
+        if self.migrated:
+            for table in INDEX_TABLES:
+                connection.execute(f"DROP TABLE IF EXISTS {table}")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+
+    def connection(self) -> sqlite3.Connection:
+        connection: Union[sqlite3.Connection, None] = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return connection
+
+    def index_day(self, date: str, data_directory: str = DATA_DIRECTORY) -> Dict[str, int]:
+        # Replaces the day in one transaction, so re-running the pipeline for a date does not duplicate rows
+        rows: Dict[str, List[Tuple[Any, ...]]] = day_rows(data_directory, date)
+        connection: sqlite3.Connection = self.connection()
+        with connection:
+            for table in ["clusters", "articles", "stats"]:
+                connection.execute(f"DELETE FROM {table} WHERE date = ?", (date,))
+            connection.executemany("INSERT INTO clusters (date, category, cluster_id, size, summary) VALUES (?, ?, ?, ?, ?)",
+                                   rows["clusters"])
+            connection.executemany(
+                """INSERT INTO articles (date, category, cluster_id, title, authors, source, publish_date, url, text)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows["articles"])
+            connection.executemany("INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)", rows["stats"])
+        return {table: len(table_rows) for table, table_rows in rows.items()}
+
+    def index_all(self, data_directory: str = DATA_DIRECTORY) -> Dict[str, Dict[str, int]]:
+        return {date: self.index_day(date, data_directory)
+                for date in sorted(os.listdir(data_directory)) if DATE_PATTERN.match(date)}
+
+    def rebuild_if_migrated(self, data_directory: str = DATA_DIRECTORY) -> Dict[str, Dict[str, int]]:
+        # Dropped tables would otherwise leave the range endpoints empty until every day was re-indexed by hand
+        if not self.migrated or not os.path.isdir(data_directory):
+            return {}
+        print(f"News index schema is now version {SCHEMA_VERSION}, re-indexing {data_directory}")
+        counts: Dict[str, Dict[str, int]] = self.index_all(data_directory)
+        self.migrated = False
+        return counts
+
+    def query(self, sql: str, params: List[Any] = None) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self.connection().execute(sql, params or []).fetchall()]
+
+    def count(self, table: str, where: str, params: List[Any]) -> int:
+        return self.connection().execute(f"SELECT COUNT(*) FROM {table} {where}", params).fetchone()[0]
+
+    def query_summaries(self, start_date: str = None, end_date: str = None, category: str = None, source: str = None,
+                        offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        where, params = build_filters(start_date, end_date, category, source, table="clusters")
+        return {
+            "total": self.count("clusters", where, params),
+            "items": self.query(
+                f"""SELECT date, category, cluster_id, size, summary FROM clusters {where}
+                    ORDER BY date DESC, category, cluster_id LIMIT ? OFFSET ?""", params + [limit, offset]),
+        }
+
+    def query_articles(self, start_date: str = None, end_date: str = None, category: str = None, source: str = None,
+                       offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        # Metadata only, article texts stay in the index
+        where, params = build_filters(start_date, end_date, category, source, table="articles")
+        return {
+            "total": self.count("articles", where, params),
+            "items": self.query(
+                f"""SELECT date, category, cluster_id, title, authors, source, publish_date, url FROM articles {where}
+                    ORDER BY date DESC, publish_date DESC LIMIT ? OFFSET ?""", params + [limit, offset]),
+        }
+
+    def query_stats(self, start_date: str = None, end_date: str = None, category: str = None, source: str = None,
+                    offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        where, params = build_filters(start_date, end_date, category, source, table="stats")
+        items: List[Dict[str, Any]] = self.query(
+            f"""SELECT date, category, cluster_id, object_index, object, headings, data FROM stats {where}
+                ORDER BY date DESC, category, cluster_id, object_index LIMIT ? OFFSET ?""", params + [limit, offset])
+        for item in items:
+            item["headings"] = json.loads(item["headings"])
+            item["data"] = json.loads(item["data"])
+        return {"total": self.count("stats", where, params), "items": items}
+
+    def search(self, query: str, kind: str = "all", start_date: str = None, end_date: str = None, category: str = None,
+               limit: int = 20, match_all: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        # BM25-ranked matches (best first) with highlighted snippets; titles weigh more than article bodies
+        match: str = fts_query(query, match_all)
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        if not match:
+            return results
+        if kind in ("all", "articles"):
+            where, params = build_filters(start_date, end_date, category, table="articles")
+            where = f"{where} AND" if where else "WHERE"
+            results["articles"] = self.query(
+                f"""SELECT articles.date, articles.category, articles.cluster_id, articles.title, articles.source, articles.url,
+                           articles.publish_date, bm25(articles_fts, 5.0, 1.0) AS score,
+                           snippet(articles_fts, 1, '<b>', '</b>', '…', {SNIPPET_TOKENS}) AS snippet
+                    FROM articles_fts JOIN articles ON articles.rowid = articles_fts.rowid
+                    {where} articles_fts MATCH ?
+                    ORDER BY score LIMIT ?""", params + [match, limit])
+        if kind in ("all", "summaries"):
+            where, params = build_filters(start_date, end_date, category, table="clusters")
+            where = f"{where} AND" if where else "WHERE"
+            results["summaries"] = self.query(
+                f"""SELECT clusters.date, clusters.category, clusters.cluster_id, clusters.size, bm25(clusters_fts) AS score,
+                           snippet(clusters_fts, 0, '<b>', '</b>', '…', {SNIPPET_TOKENS}) AS snippet
+                    FROM clusters_fts JOIN clusters ON clusters.rowid = clusters_fts.rowid
+                    {where} clusters_fts MATCH ?
+                    ORDER BY score LIMIT ?""", params + [match, limit])
+        return results
+
+    def sources(self) -> List[Dict[str, Any]]:
+        return self.query("SELECT source, COUNT(*) AS articles, MIN(date) AS first_date, MAX(date) AS last_date "
+                          "FROM articles GROUP BY source ORDER BY articles DESC")
+
+_news_index: Union[NewsIndex, None] = None
+_news_index_lock: threading.Lock = threading.Lock()
+
+def get_news_index() -> NewsIndex:
+    # The first call may rebuild the whole index, so the API makes it at startup in the file I/O pool; the lock keeps
+    # pool threads from opening a second instance and racing it through the drop and rebuild
+    global _news_index
+    with _news_index_lock:
+        if _news_index is None:
+            index: NewsIndex = NewsIndex()
+            index.rebuild_if_migrated()
+            _news_index = index
+    return _news_index
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the multi-day news index from the data directory")
+    parser.add_argument("--date", help="YYYY-MM-DD, every day under the data directory when omitted")
+    args = parser.parse_args()
+
+    index: NewsIndex = NewsIndex()
+    counts: Dict[str, Dict[str, int]] = index.rebuild_if_migrated() or \
+        ({args.date: index.index_day(args.date)} if args.date else index.index_all())
+    for date, day_counts in counts.items():
+        print(f"{date}: {day_counts}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from transformers import AutoTokenizer, AutoModel, PreTrainedTokenizerBase
+from sentence_transformers import SentenceTransformer
+import numpy as np
+import multiprocessing
+import resource
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+
+HF_MODEL_ID: str = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIRECTORY: str = os.getenv("ONNX_MODEL_DIRECTORY", ".././models/all-MiniLM-L6-v2-onnx")
+FP32_MODEL_NAME: str = "model.onnx"
+INT8_MODEL_NAME: str = "model_int8.onnx"
+MAX_SEQ_LENGTH: int = 256
+
+# (session, tokenizer) per model directory, so the model is loaded once per process
+_onnx_sessions: Dict[str, Tuple[ort.InferenceSession, PreTrainedTokenizerBase]] = {}
+
+def export_onnx_model(model_directory: str = ONNX_MODEL_DIRECTORY) -> str:
+    import torch
+
+    if not os.path.exists(model_directory):
+        os.makedirs(model_directory, exist_ok=True)
+
+    tokenizer: PreTrainedTokenizerBase = AutoTokenizer.from_pretrained(HF_MODEL_ID)
+    model = AutoModel.from_pretrained(HF_MODEL_ID)
+    model.eval()
+
+    inputs = tokenizer(["export sample text"], padding=True, truncation=True, return_tensors="pt")
+    fp32_path: str = os.path.join(model_directory, FP32_MODEL_NAME)
+    dynamic_axes: Dict[str, Dict[int, str]] = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "token_type_ids": {0: "batch", 1: "sequence"},
+        "last_hidden_state": {0: "batch", 1: "sequence"},
+    }
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (inputs["input_ids"], inputs["attention_mask"], inputs["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(model_directory)
+
+    print(f"ONNX model exported to {fp32_path}")
+    return fp32_path
+
+def quantize_onnx_model(model_directory: str = ONNX_MODEL_DIRECTORY) -> str:
+    fp32_path: str = os.path.join(model_directory, FP32_MODEL_NAME)
+    int8_path: str = os.path.join(model_directory, INT8_MODEL_NAME)
+    if not os.path.exists(fp32_path):
+        export_onnx_model(model_directory)
+
+    # Dynamic quantization: int8 weights, activations quantized on the fly (no calibration data needed)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    print(f"Quantized model saved to {int8_path} "
+          f"({os.path.getsize(fp32_path) / 1e6:.1f} MB -> {os.path.getsize(int8_path) / 1e6:.1f} MB)")
+    return int8_path
+
+def get_onnx_session(model_directory: str = ONNX_MODEL_DIRECTORY) -> Tuple[ort.InferenceSession, PreTrainedTokenizerBase]:
+    if model_directory in _onnx_sessions:
+        return _onnx_sessions[model_directory]
+
+    int8_path: str = os.path.join(model_directory, INT8_MODEL_NAME)
+    if not os.path.exists(int8_path):
+        quantize_onnx_model(model_directory)
+
+    options: ort.SessionOptions = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session: ort.InferenceSession = ort.InferenceSession(int8_path, options, providers=["CPUExecutionProvider"])
+    tokenizer: PreTrainedTokenizerBase = AutoTokenizer.from_pretrained(model_directory)
+
+    _onnx_sessions[model_directory] = (session, tokenizer)
+    return session, tokenizer
+
+def onnx_encode(texts: List[str], batch_size: int = 32, model_directory: str = ONNX_MODEL_DIRECTORY) -> np.ndarray:
+    session, tokenizer = get_onnx_session(model_directory)
+    input_names: List[str] = [i.name for i in session.get_inputs()]
+
+    embeddings: List[np.ndarray] = []
+    for start in range(0, len(texts), batch_size):
+        batch: List[str] = texts[start:start + batch_size]
+        inputs = tokenizer(batch, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        feed: Dict[str, np.ndarray] = {name: inputs[name].astype(np.int64) for name in input_names}
+        last_hidden_state: np.ndarray = session.run(None, feed)[0]
+
+        # Same pooling as the sentence-transformers model: attention-masked mean, then L2 normalize
+        mask: np.ndarray = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled: np.ndarray = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        embeddings.append(pooled.astype(np.float32))
+
+    return np.vstack(embeddings)
+
+def parity_check(texts: List[str], threshold: float = 0.98, model_directory: str = ONNX_MODEL_DIRECTORY) -> Dict[str, float]:
+    model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2')
+    torch_vectors: np.ndarray = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    onnx_vectors: np.ndarray = onnx_encode(texts, model_directory=model_directory)
+
+    # Both sides are unit length, so the row-wise dot product is the cosine similarity
+    cosine: np.ndarray = np.sum(torch_vectors * onnx_vectors, axis=1)
+    result: Dict[str, float] = {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "below_threshold": int((cosine < threshold).sum()),
+    }
+
+    print("Min cosine similarity: {:.4f}".format(result["min_cosine"]))
+    print("Mean cosine similarity: {:.4f}".format(result["mean_cosine"]))
+    print(f"Vectors below {threshold}: {result['below_threshold']} of {len(texts)}")
+    return result
+
+def run_backend(backend: str, texts: List[str], batch_size: int = 32, model_directory: str = ONNX_MODEL_DIRECTORY) -> Dict[str, float]:
+    # ru_maxrss is the process peak in KB on Linux; the RSS figures include loading the model, the timings only cover
+    # encoding. The baseline is taken after this module's imports, so it holds the torch and onnxruntime libraries
+    rss_before: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if backend == "onnx_int8":
+        get_onnx_session(model_directory)
+        st: float = time.time()
+        onnx_encode(texts, batch_size=batch_size, model_directory=model_directory)
+        et: float = time.time()
+        model_size_mb: float = os.path.getsize(os.path.join(model_directory, INT8_MODEL_NAME)) / 1e6
+    else:
+        model: SentenceTransformer = SentenceTransformer('all-MiniLM-L6-v2', device="cpu")
+        st = time.time()
+        model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        et = time.time()
+        model_size_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 1e6
+    rss_peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "seconds": et - st,
+        "texts_per_second": len(texts) / (et - st),
+        "peak_rss_mb": rss_peak / 1024,
+        "peak_rss_increase_mb": (rss_peak - rss_before) / 1024,
+        "model_size_mb": model_size_mb,
+    }
+
+def benchmark_throughput(texts: List[str], batch_size: int = 32, model_directory: str = ONNX_MODEL_DIRECTORY) -> Dict[str, Dict[str, float]]:
+    # Each backend runs in a fresh spawned interpreter, so neither peak includes the other's model or the export and
+    # quantization done in this process
+    results: Dict[str, Dict[str, float]] = {}
+    for backend in ["onnx_int8", "pytorch"]:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results[backend] = pool.apply(run_backend, (backend, texts, batch_size, model_directory))
+
+    for backend, stats in results.items():
+        print("{}: {:.1f} texts/s, {:.2f} seconds, {:.0f} MB peak RSS (+{:.0f} MB for the model and encoding), {:.1f} MB model".format(
+            backend, stats["texts_per_second"], stats["seconds"], stats["peak_rss_mb"], stats["peak_rss_increase_mb"],
+            stats["model_size_mb"]))
+    print("Speedup: {:.2f}x".format(results["pytorch"]["seconds"] / results["onnx_int8"]["seconds"]))
+    return results
+
+if __name__ == "__main__":
+    from k_means_cluster import fetch_and_merge_json_files, preprocess_text
+    import nltk
+    nltk.download('punkt')
+    nltk.download('stopwords')
+
+    quantize_onnx_model()
+
+    articles: List[Dict[str, Union[str, int, List[str]]]] = fetch_and_merge_json_files(".././data/2024-06-20/business/articles")
+    texts: List[str] = [preprocess_text(article["text"]) for article in articles]
+    texts = [text for text in texts if text]
+
+    benchmark_throughput(texts)
+    parity_check(texts)
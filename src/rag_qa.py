@@ -0,0 +1,200 @@
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from collections import OrderedDict
+import numpy as np
+import threading
+import asyncio
+import time
+import re
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable
+from llm_provider import get_llm
+from news_index import get_news_index
+from vector_index import get_vector_index, embed_query, VectorIndex
+from data_access import run_blocking
+
+# Bump when the QA prompt or context layout changes, so cached answers are not reused
+QA_PROMPT_VERSION: str = "qa-v1"
+# The Streamlit chain retrieved 2 chunks; whole articles from several clusters answer headline questions better
+QA_TOP_K: int = int(os.getenv("QA_TOP_K", "6"))
+QA_ARTICLE_CHARS: int = int(os.getenv("QA_ARTICLE_CHARS", "2000"))
+QA_EMBEDDING_CACHE_SIZE: int = int(os.getenv("QA_EMBEDDING_CACHE_SIZE", "2048"))
+QA_RETRIEVAL_CACHE_SIZE: int = int(os.getenv("QA_RETRIEVAL_CACHE_SIZE", "1024"))
+QA_ANSWER_CACHE_SIZE: int = int(os.getenv("QA_ANSWER_CACHE_SIZE", "512"))
+# A question whose embedding is at least this close to a cached one, for the same dates and index, reuses its answer
+QA_SIMILAR_QUESTION_THRESHOLD: float = float(os.getenv("QA_SIMILAR_QUESTION_THRESHOLD", "0.95"))
+
+QA_SYSTEM_PROMPT: str = """You are a news assistant for Pakistani news. Answer the user's question using only the
+articles below, mentioning dates and sources where they matter. If the articles do not contain the answer, say that you
+don't know.
+
+{context}"""
+
+def normalize_question(question: str) -> str:
+    # Case, punctuation and spacing differences map to the same cache key
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+class LRUCache:
+    # Entry-bounded, thread-safe; values are small (vectors, row lists, answers) so entries are not sized
+    def __init__(self, max_entries: int):
+        self.max_entries: int = max_entries
+        self.entries: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def set(self, key: Tuple[Any, ...], value: Any) -> None:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def values(self) -> List[Tuple[Tuple[Any, ...], Any]]:
+        with self.lock:
+            return list(self.entries.items())
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+def format_context(rows: List[Dict[str, Any]]) -> str:
+    return "\n\n".join(f"[{i + 1}] {row['title']} ({row['date']}, {row['source']})\n{row.get('text', '')}"
+                       for i, row in enumerate(rows))
+
+class QAService:
+    # Retriever and chain are built once per process; each stage has its own cache so a changed date range or a
+    # rebuilt index only repeats the stages it affects
+    def __init__(self, vector_index: VectorIndex = None, top_k: int = QA_TOP_K):
+        self.vector_index: VectorIndex = vector_index or get_vector_index()
+        self.top_k: int = top_k
+        prompt = ChatPromptTemplate.from_messages([("system", QA_SYSTEM_PROMPT), ("human", "{input}")])
+        self.chain = prompt | get_llm() | StrOutputParser()
+        self.embeddings: LRUCache = LRUCache(QA_EMBEDDING_CACHE_SIZE)
+        self.retrievals: LRUCache = LRUCache(QA_RETRIEVAL_CACHE_SIZE)
+        self.answers: LRUCache = LRUCache(QA_ANSWER_CACHE_SIZE)
+        # Identical questions arriving together share one LLM call
+        self.pending: Dict[Tuple[Any, ...], asyncio.Future] = {}
+        self.llm_calls: int = 0
+        self.similar_hits: int = 0
+
+    def embed(self, question: str) -> np.ndarray:
+        key: Tuple[str] = (normalize_question(question),)
+        vector: Union[np.ndarray, None] = self.embeddings.get(key)
+        if vector is None:
+            vector = embed_query(question)
+            self.embeddings.set(key, vector)
+        return vector
+
+    def retrieve(self, question: str, vector: np.ndarray, start_date: str, end_date: str, category: str,
+                 version: str) -> List[Dict[str, Any]]:
+        key: Tuple[Any, ...] = (normalize_question(question), start_date, end_date, category, version, self.top_k)
+        rows: Union[List[Dict[str, Any]], None] = self.retrievals.get(key)
+        if rows is None:
+            rows = self.vector_index.search(vector, start_date, end_date, category, self.top_k)
+            for row in rows:
+                # Article text comes from the news index; the vector shards only hold ids and titles
+                texts: List[Dict[str, Any]] = get_news_index().query(
+                    "SELECT text FROM articles WHERE date = ? AND category = ? AND url = ? LIMIT 1",
+                    [row["date"], row["category"], row["url"]])
+                row["text"] = (texts[0]["text"] or "")[:QA_ARTICLE_CHARS] if texts else ""
+            self.retrievals.set(key, rows)
+        return rows
+
+    def similar_answer(self, vector: np.ndarray, scope: Tuple[Any, ...]) -> Union[Dict[str, Any], None]:
+        # Near-identical wording ("imf loan tranche" / "the IMF tranche of the loan") lands close in embedding space
+        best: Tuple[float, Union[Dict[str, Any], None]] = (QA_SIMILAR_QUESTION_THRESHOLD, None)
+        for key, answer in self.answers.values():
+            if key[1:] != scope:
+                continue
+            score: float = float(np.dot(vector, answer["vector"]))
+            if score >= best[0]:
+                best = (score, answer)
+        return best[1]
+
+    async def answer(self, question: str, start_date: str = None, end_date: str = None,
+                     category: str = None) -> Dict[str, Any]:
+        st: float = time.perf_counter()
+        version: str = await run_blocking(self.vector_index.version, start_date, end_date)
+        scope: Tuple[Any, ...] = (start_date, end_date, category, version, QA_PROMPT_VERSION)
+        key: Tuple[Any, ...] = (normalize_question(question), *scope)
+
+        def respond(answer: Dict[str, Any], cached: Union[str, None]) -> Dict[str, Any]:
+            return {"question": question, "answer": answer["answer"], "sources": answer["sources"], "cached": cached,
+                    "index_version": version, "took_ms": round((time.perf_counter() - st) * 1000, 2)}
+
+        answer: Union[Dict[str, Any], None] = self.answers.get(key)
+        if answer is not None:
+            return respond(answer, "exact")
+        if key in self.pending:
+            pending: asyncio.Future = self.pending[key]
+            try:
+                return respond(await asyncio.shield(pending), "pending")
+            except asyncio.CancelledError:
+                # The request doing the work was cancelled (its client went away); this one is still live, so it
+                # takes over the question instead of failing with it
+                if not pending.cancelled():
+                    raise
+                return await self.answer(question, start_date, end_date, category)
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            vector: np.ndarray = await run_blocking(self.embed, question)
+            answer = self.similar_answer(vector, scope)
+            if answer is not None:
+                self.similar_hits += 1
+                future.set_result(answer)
+                return respond(answer, "similar")
+
+            rows: List[Dict[str, Any]] = await run_blocking(self.retrieve, question, vector, start_date, end_date,
+                                                            category, version)
+            if rows:
+                self.llm_calls += 1
+                text: str = await self.chain.ainvoke({"input": question, "context": format_context(rows)})
+            else:
+                text = "No indexed articles match this question for the selected dates."
+            answer = {
+                "answer": text.strip(),
+                "sources": [{field: row[field] for field in ["date", "category", "cluster_id", "title", "source", "url", "score"]}
+                            for row in rows],
+                "vector": vector,
+            }
+            self.answers.set(key, answer)
+            future.set_result(answer)
+            return respond(answer, None)
+        except Exception as error:
+            future.set_exception(error)
+            # Marks the exception retrieved, so requests that were not waiting on it do not log a warning
+            future.exception()
+            raise
+        finally:
+            # Cancellation is not an Exception; without this the waiters would await the future forever
+            if not future.done():
+                future.cancel()
+            self.pending.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"embeddings": self.embeddings.stats(), "retrievals": self.retrievals.stats(), "answers": self.answers.stats(),
+                "similar_hits": self.similar_hits, "llm_calls": self.llm_calls}
+
+_qa_service: Union[QAService, None] = None
+
+def get_qa_service() -> QAService:
+    global _qa_service
+    if _qa_service is None:
+        _qa_service = QAService()
+    return _qa_service
+
+def get_qa_stats() -> Dict[str, Any]:
+    # For metrics scrapes, which should not build the chain just to report on it
+    return _qa_service.stats() if _qa_service is not None else {}
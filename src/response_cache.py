@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+import gzip
+import json
+import os
+from typing import Tuple, List, Any, Dict, Union, Callable
+
+RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Also keep a gzip copy of bodies over RESPONSE_PRECOMPRESS_MIN_BYTES, so compression runs once per body, not per request
+RESPONSE_PRECOMPRESS: bool = os.getenv("RESPONSE_PRECOMPRESS", "1") == "1"
+RESPONSE_PRECOMPRESS_MIN_BYTES: int = int(os.getenv("RESPONSE_PRECOMPRESS_MIN_BYTES", "1000"))
+
+try:
+    import orjson
+
+    def encode_json(content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    def encode_json(content: Any) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class CachedBody:
+    def __init__(self, body: bytes, gzipped: Union[bytes, None]):
+        self.body: bytes = body
+        self.gzipped: Union[bytes, None] = gzipped
+        self.size: int = len(body) + len(gzipped or b"")
+
+def serialize(content: Any) -> CachedBody:
+    body: bytes = encode_json(content)
+    gzipped: Union[bytes, None] = None
+    if RESPONSE_PRECOMPRESS and len(body) >= RESPONSE_PRECOMPRESS_MIN_BYTES:
+        gzipped = gzip.compress(body, compresslevel=6)
+    return CachedBody(body, gzipped)
+
+class ResponseCache:
+    # Serialized response bodies, least recently used evicted first once max_bytes is exceeded
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes: int = max_bytes
+        self.entries: "OrderedDict[Tuple[Any, ...], CachedBody]" = OrderedDict()
+        self.size: int = 0
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Union[CachedBody, None]:
+        with self.lock:
+            entry: Union[CachedBody, None] = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: Tuple[Any, ...], entry: CachedBody) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self.lock:
+            previous: Union[CachedBody, None] = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def get_or_build(self, key: Tuple[Any, ...], build: Callable[[], Any]) -> CachedBody:
+        # Builds and serializes on a miss; two concurrent misses may both build, the later one wins
+        entry: Union[CachedBody, None] = self.get(key)
+        if entry is None:
+            entry = serialize(build())
+            self.set(key, entry)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+_response_cache: Union[ResponseCache, None] = None
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
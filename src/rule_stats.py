@@ -0,0 +1,141 @@
+import argparse
+import os
+import re
+from typing import Tuple, List, Any, Dict, Union
+from extractive import split_sentences, NUMERIC_PATTERN
+
+# Clusters scoring below this go to the LLM in the hybrid stats mode
+STATS_RULE_MIN_CONFIDENCE: float = float(os.getenv("STATS_RULE_MIN_CONFIDENCE", "0.6"))
+
+# Commas only between digits, so "$50,000, the cars" reads 50,000
+NUMBER: str = r"(?:\d[\d,]*\d|\d)(?:\.\d+)?"
+# Index levels are in the thousands; smaller numbers near an index name are changes or percentages
+INDEX_LEVEL: str = r"(?:\d{1,3}(?:,\d{3})+|\d{4,})(?:\.\d+)?"
+AMOUNT_PATTERN: re.Pattern = re.compile(
+    rf"(?P<currency>Rs\.?|PKR|US\$|USD|\$)\s?(?P<value>{NUMBER})\s?(?P<unit>trillion|billion|million|crore|lakh|thousand|bn|mn|m|b)?\b",
+    re.IGNORECASE,
+)
+PERCENT_PATTERN: re.Pattern = re.compile(rf"(?P<value>{NUMBER})\s?(?:%|pc\b|per\s?cent\b)", re.IGNORECASE)
+# "closed at 78,802 points", "to stand at 78,445.58", "hit an all-time high of 78,115", "soared past the 78,000 mark"
+INDEX_PATTERN: re.Pattern = re.compile(
+    rf"(?P<index>KSE-?100|KSE-?30|KMI-?30|All[- ]Share)\b[^.]*?\b(?:at|to|of|past|above|crossed|hit|reached|touched)\s"
+    rf"(?:the\s)?(?P<value>{INDEX_LEVEL})(?![\d.]*\s?(?:%|per\s?cent))(?:\s?points)?",
+    re.IGNORECASE,
+)
+PERIOD_PATTERN: re.Pattern = re.compile(
+    r"\b(year-on-year|YoY|month-on-month|MoM|week-on-week|WoW|quarter-on-quarter|QoQ|annually|annual)\b", re.IGNORECASE)
+UP_PATTERN: re.Pattern = re.compile(r"\b(up|rose|rise|risen|increased?|gained?|grew|growth|jumped|surged|higher)\b", re.IGNORECASE)
+DOWN_PATTERN: re.Pattern = re.compile(r"\b(down|fell|fallen|decreased?|declined?|dropped|lost|slumped|lower|contracted)\b", re.IGNORECASE)
+UNITS: Dict[str, str] = {"bn": "billion", "b": "billion", "mn": "million", "m": "million"}
+LABEL_STOPWORDS: set = {"of", "at", "to", "was", "were", "is", "are", "by", "for", "stood", "the", "a", "an", "about", "around",
+                        "nearly", "over", "from", "and", "worth", "reached", "touched", "with", "up", "down"}
+# Connectives and verbs that name nothing; a label made only of these ("or", "compared", "mentioning") is no label
+LABEL_FILLER: set = {"or", "but", "against", "compared", "comparing", "mentioning", "than", "more", "less", "while", "which",
+                     "that", "this", "these", "those", "there", "it", "its", "as", "in", "on", "into", "also", "only", "just",
+                     "be", "been", "being", "has", "have", "had", "will", "would", "new", "between", "if", "not", "given",
+                     "now", "includes", "including", "least", "almost", "much", "per", "cent", "percent", "high", "low"}
+
+def label_before(sentence: str, start: int, max_words: int = 8) -> str:
+    # The words leading up to a figure, within its clause, name what the figure measures
+    clause: str = re.split(r"[,;:()]", sentence[:start])[-1]
+    words: List[str] = [word for word in re.findall(r"[\w'\-&/]+", clause) if not re.search(r"\d", word)][-max_words:]
+    while words and words[-1].lower() in LABEL_STOPWORDS | LABEL_FILLER:
+        words.pop()
+    while words and words[0].lower() in LABEL_STOPWORDS | LABEL_FILLER:
+        words.pop(0)
+    return " ".join(words)
+
+def direction(sentence: str) -> str:
+    up: bool = bool(UP_PATTERN.search(sentence))
+    down: bool = bool(DOWN_PATTERN.search(sentence))
+    return "up" if up and not down else "down" if down and not up else ""
+
+def extract_sentence_figures(sentence: str, date: str) -> List[Tuple[str, Tuple[str, ...], float]]:
+    # (table, row, confidence) for every figure a rule recognizes in the sentence
+    figures: List[Tuple[str, Tuple[str, ...], float]] = []
+    covered: List[Tuple[int, int]] = []
+    for match in INDEX_PATTERN.finditer(sentence):
+        name: str = re.sub(r"^(KSE|KMI)-?", r"\1-", match["index"].upper())
+        figures.append(("index", (name, match["value"], date), 0.95))
+        covered.append(match.span("value"))
+    for match in AMOUNT_PATTERN.finditer(sentence):
+        unit: str = (match["unit"] or "").lower()
+        currency: str = "USD" if "$" in match["currency"] or match["currency"].upper() == "USD" else "PKR"
+        covered.append(match.span("value"))
+        label: str = label_before(sentence, match.start())
+        if not label:
+            # A figure nobody can tell the meaning of is noise in the table
+            continue
+        figures.append(("amount", (label, match["value"], currency, UNITS.get(unit, unit), date), 0.9 if unit else 0.75))
+    for match in PERCENT_PATTERN.finditer(sentence):
+        if any(start <= match.start() < end for start, end in covered):
+            continue
+        period: Union[re.Match, None] = PERIOD_PATTERN.search(sentence)
+        move: str = direction(sentence)
+        label: str = label_before(sentence, match.start())
+        if not label:
+            continue
+        figures.append(("percent", (label, match["value"], move, period[1] if period else "", date),
+                        0.85 if move or period else 0.6))
+    return figures
+
+TABLES: Dict[str, Tuple[str, List[str]]] = {
+    "index": ("Stock market index levels", ["Index", "Level (points)", "Date"]),
+    "amount": ("Monetary figures", ["Item", "Amount", "Currency", "Unit", "Date"]),
+    "percent": ("Percentage figures", ["Item", "Value (%)", "Direction", "Period", "Date"]),
+}
+
+def extract_rule_stats(records: List[Dict[str, Union[str, int, List[str]]]]) -> Tuple[List[Dict[str, Any]], float]:
+    # Returns stats objects in the create_stats format and a confidence in [0, 1]:
+    # the mean figure confidence times the share of numeric sentences at least one rule understood
+    rows: Dict[str, Dict[Tuple[str, ...], float]] = {table: {} for table in TABLES}
+    numeric_sentences: int = 0
+    matched_sentences: int = 0
+    for record in records:
+        date: str = str(record.get("publish_date") or "")[:10]
+        for sentence in split_sentences(record["text"]):
+            if not NUMERIC_PATTERN.search(sentence):
+                continue
+            numeric_sentences += 1
+            figures: List[Tuple[str, Tuple[str, ...], float]] = extract_sentence_figures(sentence, date)
+            if figures:
+                matched_sentences += 1
+            for table, row, confidence in figures:
+                rows[table][row] = max(confidence, rows[table].get(row, 0.0))
+
+    if not numeric_sentences:
+        return [], 1.0
+    confidences: List[float] = [confidence for table_rows in rows.values() for confidence in table_rows.values()]
+    if not confidences:
+        return [], 0.0
+    confidence: float = sum(confidences) / len(confidences) * matched_sentences / numeric_sentences
+
+    stats: List[Dict[str, Any]] = []
+    for table, (title, headings) in TABLES.items():
+        if rows[table]:
+            stats.append({
+                # Rows come from every article in the cluster, so the title names the table, not one article
+                "object": title,
+                "headings": headings,
+                "data": [list(row) for row in rows[table]],
+                "confidence": round(sum(rows[table].values()) / len(rows[table]), 2),
+                "extractor": "rules",
+            })
+    return stats, round(confidence, 2)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the rule-based stats extractor over a day's clusters")
+    parser.add_argument("clusters_directory")
+    args = parser.parse_args()
+
+    from cluster_store import load_day_clusters
+    accepted: int = 0
+    clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]] = load_day_clusters(args.clusters_directory)
+    for id, meta in clusters:
+        stats, confidence = extract_rule_stats(meta)
+        accepted += confidence >= STATS_RULE_MIN_CONFIDENCE
+        print(f"cluster {id}: confidence {confidence:.2f}, {sum(len(s['data']) for s in stats)} rows")
+    print(f"{accepted} of {len(clusters)} clusters at or above confidence {STATS_RULE_MIN_CONFIDENCE}")
+
+if __name__ == "__main__":
+    main()
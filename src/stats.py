@@ -6,11 +6,36 @@ from langchain_google_genai import GoogleGenerativeAI
 from dotenv import load_dotenv
 import os
 import json
+import asyncio
 import re
 from typing import Tuple, List, Any, Dict, Union
+from cluster_store import load_day_clusters
+from summarization import records_to_documents
+from llm_cache import get_llm_cache, content_hash
+from llm_provider import get_llm, get_model_name
+from extractive import select_numeric_sentences, records_tokens
+from rule_stats import extract_rule_stats, STATS_RULE_MIN_CONFIDENCE
+from stats_parser import StatsStreamParser
+from llm_runner import run_llm_tasks, new_runner_stats, RateLimiter, LLM_MAX_CONCURRENCY
+from langchain_core.output_parsers import StrOutputParser
 
 load_dotenv()
 
+# Bump when the stats prompt changes, so cached stats are not reused
+STATS_PROMPT_VERSION = "stats-v1"
+# Send only sentences with figures (and their neighbours) to the stats LLM; clusters with none skip the call
+STATS_NUMERIC_PREFILTER = os.getenv("STATS_NUMERIC_PREFILTER", "1") == "1"
+STATS_PREFILTER_CONTEXT = int(os.getenv("STATS_PREFILTER_CONTEXT", "1"))
+# "hybrid" keeps rule-based stats (rule_stats.py) when confident enough and asks the LLM otherwise; "rules" or "llm" use one only.
+# The LLM stays the default until the rule output has been checked against more days
+STATS_EXTRACTOR = os.getenv("STATS_EXTRACTOR", "llm")
+# Extra LLM calls for a cluster whose response had no usable stats object at all
+STATS_PARSE_RETRIES = int(os.getenv("STATS_PARSE_RETRIES", "1"))
+
+def get_stats_prompt_version():
+    # The prefiltered prompt sees different input, so its results are cached separately
+    return f"{STATS_PROMPT_VERSION}-numeric" if STATS_NUMERIC_PREFILTER else STATS_PROMPT_VERSION
+
 def get_all_file_paths(directory: str) -> List[str]:
     file_paths: List[str] = []
     for root, _, files in os.walk(directory):
@@ -27,16 +52,10 @@ def json_load(file_path: str) -> List[str]:
                             )
     return loader.load()
 
-def clean_json_string(json_string):
-    # Remove trailing commas before closing brackets and braces
-    json_string = re.sub(r',\s*([\]}])', r'\1', json_string)
-    # Remove trailing commas before closing square brackets in arrays
-    json_string = re.sub(r',\s*]', r']', json_string)
-    return json_string
-
 def get_chain():
     #llm = ChatOpenAI(openai_api_key=os.getenv("OPENAI_API_KEY"), temperature=0, model_name="gpt-4o")
-    llm = GoogleGenerativeAI(temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"), model="gemini-1.5-flash-latest")
+    #llm = GoogleGenerativeAI(temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"), model="gemini-1.5-flash-latest")
+    llm = get_llm()
 
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -62,7 +81,8 @@ def get_chain():
         ]
     )
 
-    chain = prompt | llm
+    # The parser turns chat model messages into plain strings, like the completion LLMs return
+    chain = prompt | llm | StrOutputParser()
     return chain
 
 # json_schema_prompt = ChatPromptTemplate.from_messages(
@@ -101,65 +121,117 @@ def get_chain():
 
 #json_schema_chain = json_schema_prompt | llm
 
-def create_stats(category, clusters_directory_path):
+async def stream_stats(stats_chain, docs):
+    # Streamed so complete objects survive a response that is cut off or malformed further on. A failure before any
+    # object arrived is raised, so run_llm_tasks can back off on rate limits; after that the salvaged objects are kept
+    parser = StatsStreamParser()
+    try:
+        async for chunk in stats_chain.astream({"input": docs}):
+            parser.feed(chunk)
+    except Exception as e:
+        if not parser.objects:
+            raise
+        print(f"Stats stream failed after {len(parser.objects)} objects: {e}")
+    return parser
+
+async def create_stats_async(category, clusters, directory_path=None, max_concurrency=LLM_MAX_CONCURRENCY, stats=None):
+    # Returns cluster id -> stats objects ([] when the cluster has none), or the exception for clusters that failed
     stats_chain = get_chain()
+    model_name = get_model_name()
+    prompt_version = get_stats_prompt_version()
     today_date = datetime.now().date()
-    directory_path = f'../data/{today_date}/{category}/stats'
+    directory_path = directory_path or f'../data/{today_date}/{category}/stats'
     if not os.path.exists(directory_path):
         os.makedirs(directory_path)
-    
-    
-    
-
-    all_json_objects_list = []
-
-    for c, cluster in enumerate(clusters_directory_path):
-        # Extract the last part of the path
-        last_part = cluster.split('/')[-1]
-
-        # Extract the number before .json
-        id = last_part.split('.')[0]
-
-        with open(cluster, 'r', encoding='utf-8') as file:
-            meta = json.load(file)
-        docs = json_load(cluster)
-        result = stats_chain.invoke({"input": docs})
-        #final_result = json_schema_chain.invoke({"input": result.content})
-
-        #print(result.content)
-        print(result)
-        #if result.content:
-        if result:
-            try:
-                # For openai llm
-                # cleaned_json_string = clean_json_string(result.content.replace('```json', '').replace('```', '').strip())
-                # all_json_objects_list = json.loads(cleaned_json_string)
-                #all_json_objects_list = json.loads(("["+result.content.split("[")).strip())
-                # For google llm
-                all_json_objects_list = json.loads(result.replace('```json', '').replace('```', '').strip())
-
-                print(all_json_objects_list)
-
-                with open(f'../data/{today_date}/{category}/stats/{id}.json', 'w', encoding='utf-8') as file:
-                    json.dump(all_json_objects_list, file, ensure_ascii=False, indent=4)
-                
-                print("Data has been successfully saved to the stats folder as JSON file.")
-
-                    # print(result.content)
-                    # with open(f'../data/{today_date}/{category}/stats/stats_{c}.json', 'w', encoding='utf-8') as file:
-                    #     json.dump(result.content, file, ensure_ascii=False, indent=4)
-            
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON: {e}")
-                print(result)
+    cache = get_llm_cache()
+    limiter = RateLimiter()
+    stats = stats if stats is not None else new_runner_stats()
+
+    def save(id, objects):
+        if objects:
+            with open(f'{directory_path}/{id}.json', 'w', encoding='utf-8') as file:
+                json.dump(objects, file, ensure_ascii=False, indent=4)
+
+    results = {}
+    pending = {}
+    for id, meta in clusters:
+        if STATS_EXTRACTOR != "llm":
+            rule_stats, confidence = extract_rule_stats(meta)
+            if STATS_EXTRACTOR == "rules" or confidence >= STATS_RULE_MIN_CONFIDENCE:
+                print(f"Stats for cluster {id} extracted by rules (confidence {confidence:.2f})")
+                save(id, rule_stats)
+                results[id] = rule_stats
+                continue
+            print(f"Rule confidence {confidence:.2f} for cluster {id} is below {STATS_RULE_MIN_CONFIDENCE}, asking the LLM")
+
+        cluster_hash = content_hash(meta)
+        cached = cache.get("stats", model_name, prompt_version, cluster_hash) if cache else None
+        if cached is not None:
+            # Unchanged cluster, reuse the stats extracted on an earlier run
+            save(id, json.loads(cached))
+            results[id] = json.loads(cached)
+            print(f"Stats for cluster {id} served from cache")
+            continue
+
+        records = meta
+        if STATS_NUMERIC_PREFILTER:
+            records = select_numeric_sentences(meta, STATS_PREFILTER_CONTEXT)
+            if not records:
+                print(f"Cluster {id} has no numeric content, skipping stats")
+                results[id] = []
+                continue
+            print(f"Cluster {id}: numeric prefilter kept {records_tokens(records)} of {records_tokens(meta)} tokens")
+        pending[id] = (cluster_hash, records)
+
+    # Rate limits and transient errors are retried with backoff inside run_llm_tasks; a parse attempt is only used up
+    # by a response that arrived but held no usable stats
+    for attempt in range(STATS_PARSE_RETRIES + 1):
+        if not pending:
+            break
+        tasks = [(id, records_tokens(records), lambda records=records: stream_stats(stats_chain, records_to_documents(records)))
+                 for id, (_, records) in pending.items()]
+        responses = await run_llm_tasks(tasks, max_concurrency, limiter, stats)
+        unusable = {}
+        for id, parser in responses.items():
+            cluster_hash, records = pending[id]
+            if isinstance(parser, Exception):
+                results[id] = parser
+                continue
+            objects = parser.finish()
+            if not objects and not parser.no_data:
+                # Empty, blocked or unparseable; never cached, so a later run asks again
+                print(f"Unusable stats response for cluster {id} (attempt {attempt + 1}): {parser.buffer[:200]!r}")
+                results[id] = RuntimeError(f"Unusable stats response for cluster {id}")
+                unusable[id] = (cluster_hash, records)
                 continue
+            if parser.truncated or parser.rejected:
+                print(f"Salvaged {len(objects)} stats objects for cluster {id} "
+                      f"({parser.rejected} rejected, truncated: {parser.truncated})")
+            if cache:
+                cache.set("stats", model_name, prompt_version, cluster_hash, json.dumps(objects, ensure_ascii=False))
+            if not objects:
+                print(f"No statistical data in cluster {id}")
+            save(id, objects)
+            results[id] = objects
+        pending = unusable
+
+    print(f"Stats LLM requests: {stats['requests']}, retries: {stats['retries']}, backoff: {stats['backoff_seconds']:.1f} seconds")
+    return results
+
+def create_stats(category, clusters, directory_path=None, max_concurrency=LLM_MAX_CONCURRENCY, stats=None):
+    # Clusters are sent concurrently, paced by the shared requests/tokens per minute limits in llm_runner
+    results = asyncio.run(create_stats_async(category, clusters, directory_path, max_concurrency, stats))
+    failed = [id for id, result in results.items() if isinstance(result, Exception)]
+    if failed:
+        print(f"Stats failed for clusters: {failed}")
+    return results
 
 def main():
     today_date = datetime.now().strftime("%Y-%m-%d")
     categories = ["business", "pakistan"]
     for category in categories:
-        clusters_directory_path = get_all_file_paths(f"../data/{today_date}/{category}/clusters")
-        create_stats(category, clusters_directory_path)
+        clusters = load_day_clusters(f"../data/{today_date}/{category}/clusters")
+        create_stats(category, clusters)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
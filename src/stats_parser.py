@@ -0,0 +1,113 @@
+import json
+import re
+from typing import Tuple, List, Any, Dict, Union, Iterable
+
+FENCE_PATTERN: re.Pattern = re.compile(r"```(?:json)?", re.IGNORECASE)
+# Strings are matched first so that commas and literals inside them are left alone
+REPAIR_PATTERN: re.Pattern = re.compile(r'("(?:[^"\\]|\\.)*")|,\s*([\]}])|\b(None|True|False)\b')
+# The stats prompt shows the list assigned to a name, and the model sometimes copies it
+ASSIGNMENT_PATTERN: re.Pattern = re.compile(r"^\s*[A-Za-z_]\w*\s*=\s*")
+PYTHON_LITERALS: Dict[str, str] = {"None": "null", "True": "true", "False": "false"}
+
+def repair_json(text: str) -> str:
+    # Fixes the defects the stats LLM output shows in practice: fences, an assignment prefix,
+    # trailing commas and Python literals outside strings
+    text = ASSIGNMENT_PATTERN.sub("", FENCE_PATTERN.sub("", text).strip())
+    return REPAIR_PATTERN.sub(lambda match: match.group(1) or match.group(2) or PYTHON_LITERALS[match.group(3)], text)
+
+def validate_stats_object(obj: Any) -> Union[Dict[str, Any], None]:
+    # Keeps only the rows whose length matches the headings; None when nothing of the table is usable
+    if not isinstance(obj, dict) or not isinstance(obj.get("object"), str):
+        return None
+    headings: Any = obj.get("headings")
+    data: Any = obj.get("data")
+    if not isinstance(headings, list) or not headings or not isinstance(data, list):
+        return None
+    rows: List[List[Any]] = [row for row in data if isinstance(row, list) and len(row) == len(headings)]
+    if not rows:
+        return None
+    validated: Dict[str, Any] = dict(obj)
+    validated.update({"headings": [str(heading) for heading in headings], "data": rows})
+    return validated
+
+class StatsStreamParser:
+    # Consumes streamed LLM text and emits each stats object as soon as its closing brace arrives,
+    # so a response cut off mid-way still yields every object that was complete
+    def __init__(self) -> None:
+        self.buffer: str = ""
+        self.position: int = 0
+        self.depth: int = 0
+        self.item_depth: Union[int, None] = None
+        self.item_start: Union[int, None] = None
+        self.in_string: bool = False
+        self.escape: bool = False
+        self.objects: List[Dict[str, Any]] = []
+        self.rejected: int = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.buffer += chunk
+        emitted: List[Dict[str, Any]] = []
+        while self.position < len(self.buffer):
+            char: str = self.buffer[self.position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "[{":
+                if self.item_depth is None:
+                    # A top-level list holds the objects one level down, a bare object is the item itself
+                    self.item_depth = 1 if char == "[" else 0
+                if char == "{" and self.depth == self.item_depth:
+                    self.item_start = self.position
+                self.depth += 1
+            elif char in "]}":
+                self.depth = max(self.depth - 1, 0)
+                if char == "}" and self.depth == self.item_depth and self.item_start is not None:
+                    obj: Union[Dict[str, Any], None] = self.parse_item(self.buffer[self.item_start:self.position + 1])
+                    self.item_start = None
+                    if obj is not None:
+                        emitted.append(obj)
+            self.position += 1
+        self.objects.extend(emitted)
+        return emitted
+
+    def parse_item(self, text: str) -> Union[Dict[str, Any], None]:
+        try:
+            obj: Union[Dict[str, Any], None] = validate_stats_object(json.loads(repair_json(text)))
+        except json.JSONDecodeError:
+            obj = None
+        if obj is None:
+            self.rejected += 1
+        return obj
+
+    def finish(self) -> List[Dict[str, Any]]:
+        # Prefer a clean parse of the whole response; fall back to the objects salvaged while streaming
+        try:
+            parsed: Any = json.loads(repair_json(self.buffer))
+        except json.JSONDecodeError:
+            return self.objects
+        if isinstance(parsed, dict):
+            parsed = [parsed]
+        if not isinstance(parsed, list):
+            return []
+        return [obj for obj in (validate_stats_object(item) for item in parsed) if obj is not None]
+
+    @property
+    def no_data(self) -> bool:
+        # The prompt asks for None when a text has no statistics; an empty or blocked response is not that answer
+        return repair_json(self.buffer).strip().rstrip(".").lower() in {"null", "none", "[]"}
+
+    @property
+    def truncated(self) -> bool:
+        return self.depth > 0 or self.in_string
+
+def parse_stats(text: Union[str, Iterable[str]]) -> List[Dict[str, Any]]:
+    parser: StatsStreamParser = StatsStreamParser()
+    for chunk in ([text] if isinstance(text, str) else text):
+        parser.feed(chunk)
+    return parser.finish()
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import re
+from typing import Tuple, List, Any, Dict, Union
+
+STATS_WAREHOUSE_PATH: str = os.getenv("STATS_WAREHOUSE_PATH", ".././data/stats_warehouse.duckdb")
+DATA_DIRECTORY: str = os.getenv("DATA_DIRECTORY", ".././data")
+DATE_PATTERN: re.Pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+MAGNITUDES: Dict[str, float] = {
+    "thousand": 1e3, "lakh": 1e5, "lac": 1e5, "million": 1e6, "mn": 1e6, "mln": 1e6, "crore": 1e7,
+    "billion": 1e9, "bn": 1e9, "bln": 1e9, "trillion": 1e12,
+}
+CURRENCIES: Dict[str, str] = {
+    "rs": "PKR", "rs.": "PKR", "pkr": "PKR", "rupees": "PKR", "usd": "USD", "us$": "USD", "$": "USD", "dollars": "USD",
+    "€": "EUR", "eur": "EUR", "£": "GBP", "gbp": "GBP",
+}
+# Words that follow a number without being its unit ("12 to 15", "5 per cent" is handled as %)
+UNIT_STOPWORDS: frozenset = frozenset(["and", "or", "to", "in", "on", "of", "from", "for", "at", "as", "the", "a", "vs", "per"])
+# A number is only read where a value starts: at the beginning, after whitespace or "(", optionally signed and behind a
+# currency. Digits inside a name ("KSE-100", "FY2024-25", "5MCY24") are skipped, as is any number followed by more
+# digits in the same token, so "2024-25" is not read as 2024
+NUMERIC_VALUE_PATTERN: re.Pattern = re.compile(
+    r"(?:^|(?<=[\s(]))(?P<sign>[+-])?(?P<currency>rs\.?|pkr|us\$|usd|\$|€|£)?\s*(?P<number>\d[\d,]*(?:\.\d+)?)(?![\w.,-]*\d)"
+    r"\s*(?P<magnitude>" + "|".join(sorted(MAGNITUDES, key=len, reverse=True)) + r")?\b\s*"
+    r"(?P<unit>%|per\s?cent\b|[a-z$€£]+\b)?", re.IGNORECASE)
+
+UNIT_TOKEN_PATTERN: re.Pattern = re.compile(r"%|us\$|rs\.?(?![a-z])|[$€£]|per\s?cent(?![a-z])|[a-z]+", re.IGNORECASE)
+
+def unit_context(text: str, words_as_unit: bool = False) -> Tuple[float, str]:
+    # The magnitude and unit a heading or a unit-only cell gives the numbers next to it: "Amount (Rs billion)" ->
+    # (1e9, "PKR"), "billion" -> (1e9, ""), "USD" -> (1.0, "USD"), "Value (%)" -> (1.0, "%"); with words_as_unit,
+    # other words name the unit, as in "Level (points)" -> (1.0, "points")
+    multiplier: float = 1.0
+    unit: str = ""
+    for token in UNIT_TOKEN_PATTERN.findall(text.lower()):
+        if token in MAGNITUDES:
+            multiplier = MAGNITUDES[token]
+        elif token in CURRENCIES:
+            unit = CURRENCIES[token]
+        elif token in ("%", "percent", "per cent", "pc"):
+            unit = "%"
+        elif words_as_unit and not unit and token not in UNIT_STOPWORDS:
+            unit = token
+    return multiplier, unit
+
+def cell_context(value: Any) -> Union[Tuple[float, str], None]:
+    # Set for cells holding nothing but a magnitude and/or currency, like the rule extractor's Currency and Unit columns
+    text: str = str(value or "").strip().lower()
+    tokens: List[str] = UNIT_TOKEN_PATTERN.findall(text)
+    if not tokens or "".join(tokens) != re.sub(r"\s+", "", text):
+        return None
+    if not all(token in MAGNITUDES or token in CURRENCIES for token in tokens):
+        return None
+    return unit_context(text)
+
+def parse_value(value: Any, context: Tuple[float, str] = (1.0, "")) -> Tuple[Union[float, None], str]:
+    # ("Rs12.97 trillion") -> (1.297e13, "PKR"), "+2,094.76 points" -> (2094.76, "points"), "11.8%" -> (11.8, "%");
+    # (None, "") for text cells and dates. context is the (magnitude, unit) of the column or row, used when the value
+    # does not state its own: "2.5" with (1e9, "USD") -> (2.5e9, "USD")
+    if isinstance(value, bool):
+        return None, ""
+    if isinstance(value, (int, float)):
+        return float(value) * context[0], context[1]
+    text: str = str(value).strip()
+    if DATE_PATTERN.match(text[:10]):
+        return None, ""
+    match: Union[re.Match, None] = NUMERIC_VALUE_PATTERN.search(text)
+    if match is None:
+        return None, ""
+    magnitude: Union[float, None] = MAGNITUDES.get((match["magnitude"] or "").lower())
+    number: float = float(match["number"].replace(",", "")) * (magnitude or context[0])
+    if match["sign"] == "-":
+        number = -number
+    unit: str = (match["unit"] or "").lower()
+    if unit in ("%", "percent", "per cent"):
+        unit = "%"
+    elif match["currency"]:
+        unit = CURRENCIES[match["currency"].lower()]
+    elif unit in CURRENCIES:
+        unit = CURRENCIES[unit]
+    elif unit in UNIT_STOPWORDS:
+        unit = ""
+    return number, unit or context[1]
+
+def parse_numeric(value: Any) -> Union[float, None]:
+    return parse_value(value)[0]
+
+def stats_rows(date: str, category: str, cluster_id: str, stats: List[Dict[str, Any]]) -> List[Tuple[Any, ...]]:
+    # One row per cell: the object title, its heading and value, plus where it came from
+    rows: List[Tuple[Any, ...]] = []
+    for object_index, obj in enumerate(stats):
+        if not isinstance(obj, dict):
+            continue
+        headings: List[Any] = obj.get("headings") or []
+        # Magnitude and currency often sit in the heading ("Amount (Rs billion)") or in sibling cells (the rule
+        # extractor's Amount / Currency / Unit columns) rather than in the value itself
+        heading_contexts: List[Tuple[float, str]] = [
+            unit_context(" ".join(re.findall(r"\(([^)]*)\)", str(heading))), words_as_unit=True)
+            if "(" in str(heading) else unit_context(str(heading)) for heading in headings]
+        for row_index, data_row in enumerate(obj.get("data") or []):
+            if not isinstance(data_row, list):
+                continue
+            row_multiplier: float = 1.0
+            row_unit: str = ""
+            for value in data_row:
+                context: Union[Tuple[float, str], None] = cell_context(value)
+                if context is not None:
+                    row_multiplier = context[0] if context[0] != 1.0 else row_multiplier
+                    row_unit = context[1] or row_unit
+            for heading, heading_context, value in zip(headings, heading_contexts, data_row):
+                numeric_value, unit = parse_value(value, (heading_context[0] if heading_context[0] != 1.0 else row_multiplier,
+                                                          heading_context[1] or row_unit))
+                rows.append((date, category, cluster_id, object_index, str(obj.get("object", "")), row_index, str(heading),
+                             None if value is None else str(value), numeric_value, obj.get("extractor", "llm"), unit))
+    return rows
+
+def build_filters(object_like: str = None, heading_like: str = None, category: str = None, start_date: str = None,
+                  end_date: str = None, numeric_only: bool = False) -> Tuple[str, List[Any]]:
+    conditions: List[str] = []
+    params: List[Any] = []
+    for column, pattern in [("object", object_like), ("heading", heading_like)]:
+        if pattern:
+            conditions.append(f"{column} ILIKE ?")
+            params.append(f"%{pattern}%")
+    for condition, param in [("category = ?", category), ("date >= ?", start_date), ("date <= ?", end_date)]:
+        if param:
+            conditions.append(condition)
+            params.append(param)
+    if numeric_only:
+        conditions.append("numeric_value IS NOT NULL")
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+class StatsWarehouse:
+    def __init__(self, path: str = STATS_WAREHOUSE_PATH, read_only: bool = False):
+        import duckdb
+
+        directory: str = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path: str = path
+        self.connection = duckdb.connect(path, read_only=read_only)
+        if not read_only:
+            self.create_table()
+        columns: List[str] = [row[0] for row in self.connection.execute("DESCRIBE stats_values").fetchall()]
+        if "unit" not in columns:
+            # Written before values carried a unit, when hyphenated names were parsed as negative numbers
+            if read_only:
+                raise RuntimeError(f"{path} predates the unit column, run `python stats_warehouse.py ingest` to rebuild it")
+            print(f"Rebuilding {path} with units")
+            self.connection.execute("DROP TABLE stats_values")
+            self.create_table()
+            self.ingest_all()
+
+    def create_table(self) -> None:
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS stats_values (
+                date DATE NOT NULL,
+                category VARCHAR NOT NULL,
+                cluster_id VARCHAR NOT NULL,
+                object_index INTEGER NOT NULL,
+                object VARCHAR NOT NULL,
+                row_index INTEGER NOT NULL,
+                heading VARCHAR NOT NULL,
+                value VARCHAR,
+                numeric_value DOUBLE,
+                extractor VARCHAR,
+                unit VARCHAR
+            )"""
+        )
+
+    def ingest_day(self, date: str, data_directory: str = DATA_DIRECTORY) -> int:
+        # Replaces everything stored for the day, so re-running the pipeline for a date does not duplicate rows
+        rows: List[Tuple[Any, ...]] = []
+        day_directory: str = os.path.join(data_directory, date)
+        for category in sorted(os.listdir(day_directory)) if os.path.isdir(day_directory) else []:
+            stats_directory: str = os.path.join(day_directory, category, "stats")
+            if not os.path.isdir(stats_directory):
+                continue
+            for file_name in sorted(os.listdir(stats_directory)):
+                if not file_name.endswith(".json"):
+                    continue
+                with open(os.path.join(stats_directory, file_name), 'r', encoding='utf-8') as file:
+                    stats: Any = json.load(file)
+                if isinstance(stats, list):
+                    rows.extend(stats_rows(date, category, file_name[:-len(".json")], stats))
+
+        self.connection.execute("BEGIN TRANSACTION")
+        try:
+            self.connection.execute("DELETE FROM stats_values WHERE date = ?", [date])
+            if rows:
+                self.connection.executemany("INSERT INTO stats_values VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def ingest_all(self, data_directory: str = DATA_DIRECTORY) -> Dict[str, int]:
+        return {date: self.ingest_day(date, data_directory)
+                for date in sorted(os.listdir(data_directory)) if DATE_PATTERN.match(date)}
+
+    def query_values(self, object_like: str = None, heading_like: str = None, category: str = None,
+                     start_date: str = None, end_date: str = None, numeric_only: bool = False,
+                     limit: int = 1000) -> List[Dict[str, Any]]:
+        # Case-insensitive substring filters, e.g. object_like="budget", heading_like="billion"
+        where, params = build_filters(object_like, heading_like, category, start_date, end_date, numeric_only)
+        return self.query(
+            f"""SELECT CAST(date AS VARCHAR) AS date, category, cluster_id, object_index, object, row_index, heading, value,
+                       numeric_value, unit, extractor
+                FROM stats_values {where}
+                ORDER BY date, category, cluster_id, object_index, row_index
+                LIMIT ?""",
+            params + [limit],
+        )
+
+    def trend(self, object_like: str = None, heading_like: str = None, category: str = None,
+              start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
+        # Daily count, sum, min and max of the numeric values matching the filters, one row per unit so rupees,
+        # percentages and index points are never added together
+        where, params = build_filters(object_like, heading_like, category, start_date, end_date, numeric_only=True)
+        return self.query(
+            f"""SELECT CAST(date AS VARCHAR) AS date, unit, COUNT(*) AS count, SUM(numeric_value) AS sum,
+                       MIN(numeric_value) AS min, MAX(numeric_value) AS max
+                FROM stats_values {where}
+                GROUP BY date, unit
+                ORDER BY date, unit""",
+            params,
+        )
+
+    def query(self, sql: str, params: List[Any] = None) -> List[Dict[str, Any]]:
+        cursor = self.connection.execute(sql, params or [])
+        columns: List[str] = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self) -> None:
+        self.connection.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load stats into the columnar warehouse and query it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="(re)load the stats of one day, or of every day")
+    ingest_parser.add_argument("--date", help="YYYY-MM-DD, every day under the data directory when omitted")
+    query_parser = subparsers.add_parser("query", help="matching values, or daily aggregates with --trend")
+    query_parser.add_argument("--object", help="substring of the stats object title")
+    query_parser.add_argument("--heading", help="substring of the column heading")
+    query_parser.add_argument("--category")
+    query_parser.add_argument("--start-date")
+    query_parser.add_argument("--end-date")
+    query_parser.add_argument("--limit", type=int, default=100)
+    query_parser.add_argument("--trend", action="store_true")
+    args = parser.parse_args()
+
+    warehouse: StatsWarehouse = StatsWarehouse(read_only=args.command == "query")
+    if args.command == "ingest":
+        counts: Dict[str, int] = {args.date: warehouse.ingest_day(args.date)} if args.date else warehouse.ingest_all()
+        for date, count in counts.items():
+            print(f"{date}: {count} values")
+    elif args.trend:
+        print(json.dumps(warehouse.trend(args.object, args.heading, args.category, args.start_date, args.end_date), indent=4))
+    else:
+        print(json.dumps(warehouse.query_values(args.object, args.heading, args.category, args.start_date, args.end_date,
+                                                limit=args.limit), indent=4, ensure_ascii=False))
+    warehouse.close()
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,27 @@ import os
 import ast # convert string to dict
 import json
 import time
+import asyncio
 from typing import Tuple, List, Any, Dict, Union
 from langchain.schema import Document
+from cluster_store import load_day_clusters, load_cluster_centroids
+from llm_runner import run_llm_tasks, run_with_retry, estimate_tokens, new_runner_stats, RateLimiter, LLM_MAX_CONCURRENCY
+from extractive import select_central_sentences, chunk_records, records_tokens
+from llm_cache import get_llm_cache, content_hash, LLMCache
+from llm_provider import get_llm, get_model_name
 
 load_dotenv()
 
+# Bump when the summarization prompt or chain changes, so cached summaries are not reused
+SUMMARY_PROMPT_VERSION: str = "stuff-v1"
+# "stuff" sends whole clusters; "budgeted" measures each cluster first and compresses or map-reduces large ones
+SUMMARY_MODE: str = os.getenv("SUMMARY_MODE", "stuff")
+SUMMARY_TOKEN_BUDGET: int = int(os.getenv("SUMMARY_TOKEN_BUDGET", "8000"))
+# Clusters up to this many budgets are compressed extractively, larger ones fall back to map-reduce
+EXTRACTIVE_MAX_FACTOR: int = int(os.getenv("EXTRACTIVE_MAX_FACTOR", "4"))
+# Reduce levels before the remaining partial summaries are sent in one prompt regardless of the budget
+MAX_REDUCE_LEVELS: int = 3
+
 def get_all_file_paths(directory: str) -> List[str]:
     file_paths: List[str] = []
     for root, _, files in os.walk(directory):
@@ -32,38 +48,182 @@ def json_load(file_path: str) -> List[str]:
                             )
     return loader.load()
 
+def records_to_documents(records: List[Dict[str, Union[str, int, List[str]]]]) -> List[Document]:
+    # Same documents json_load builds from a cluster file: one per article, the text as page content
+    return [Document(page_content=record["text"], metadata={"seq_num": c + 1}) for c, record in enumerate(records)]
+
 # def convert_to_dict(string):
 #     data_dict = ast.literal_eval(string)
     
 #     return data_dict
 
-def get_save_summary_stats(clusters_directory_path: List[str], summary_directory_path: str) -> None:  
-    g_llm: GoogleGenerativeAI = GoogleGenerativeAI(temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"), model="gemini-1.5-flash-latest")
-    summarization_chain = load_summarize_chain(g_llm, chain_type="stuff")
-    
-    for c, cluster in enumerate(clusters_directory_path):
-        # Extract the last part of the path
-        last_part: str = cluster.split('/')[-1]
-
-        # Extract the number before .json
-        id: str = last_part.split('.')[0]
-
-        with open(cluster, 'r', encoding='utf-8') as file:
-            meta: List[Dict[str, Union[str, int, List[str]]]] = json.load(file)
-        docs: List[Document] = json_load(cluster)
-        #result = chain.invoke({"input": docs})
-        summarization_result: Dict = summarization_chain.invoke(docs)
-
-        metadata_list: List[Dict[str, Union[str, int, List[str]]]] = [obj for obj in meta]
-        #len(metadata_list)
-        filename: str = f'{summary_directory_path}/{id}.json'
-        summery_dict: Dict[str, Union[str, List[Any]]] = {"summary": summarization_result["output_text"],
-                        "meta_data": metadata_list,}
-
-        with open(filename, 'w') as json_file:
-            json.dump(summery_dict, json_file, indent=4) 
-        
-        time.sleep(5)
+def save_summary(summary_directory_path: str, id: str, summary: str, meta: List[Dict[str, Union[str, int, List[str]]]]) -> None:
+    metadata_list: List[Dict[str, Union[str, int, List[str]]]] = [obj for obj in meta]
+    #len(metadata_list)
+    filename: str = f'{summary_directory_path}/{id}.json'
+    summery_dict: Dict[str, Union[str, List[Any]]] = {"summary": summary,
+                    "meta_data": metadata_list,}
+
+    with open(filename, 'w') as json_file:
+        json.dump(summery_dict, json_file, indent=4) 
+
+def get_summary_prompt_version(mode: str) -> str:
+    # v2: map-reduce summaries are only cached when every map and reduce step succeeded, so older entries may be partial
+    return SUMMARY_PROMPT_VERSION if mode == "stuff" else f"{SUMMARY_PROMPT_VERSION}-budgeted-v2-{SUMMARY_TOKEN_BUDGET}"
+
+def plan_summary(meta: List[Dict[str, Union[str, int, List[str]]]], centroid: List[float] = None,
+                 token_budget: int = SUMMARY_TOKEN_BUDGET) -> Tuple[str, List[List[Dict[str, Union[str, int, List[str]]]]]]:
+    # Returns ("stuff", [records]) for a single prompt or ("map_reduce", chunks), every prompt within token_budget
+    tokens: int = records_tokens(meta)
+    if tokens <= token_budget:
+        return "stuff", [meta]
+    if tokens <= token_budget * EXTRACTIVE_MAX_FACTOR:
+        print(f"Compressing cluster from {tokens} tokens to {token_budget}")
+        return "stuff", [select_central_sentences(meta, token_budget, centroid)]
+    chunks: List[List[Dict[str, Union[str, int, List[str]]]]] = chunk_records(meta, token_budget, centroid)
+    print(f"Cluster of {tokens} tokens split into {len(chunks)} map-reduce chunks")
+    return "map_reduce", chunks
+
+def group_partials(summaries: List[str], token_budget: int = SUMMARY_TOKEN_BUDGET) -> List[List[str]]:
+    # Packs partial summaries, in order, into groups that each fit one reduce prompt
+    groups: List[List[str]] = []
+    group: List[str] = []
+    group_tokens: int = 0
+    for summary in summaries:
+        tokens: int = estimate_tokens(summary)
+        if group and group_tokens + tokens > token_budget:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+async def reduce_clusters(summarization_chain, partials: Dict[str, List[str]], limiter: RateLimiter, stats: Dict[str, float],
+                          max_concurrency: int = LLM_MAX_CONCURRENCY,
+                          token_budget: int = SUMMARY_TOKEN_BUDGET) -> Dict[str, Union[Dict, Exception]]:
+    # Reduces every cluster's partial summaries to one, level by level: partials over the budget are reduced in groups
+    # first, and each level's calls for all clusters share one run_llm_tasks batch
+    results: Dict[str, Union[Dict, Exception]] = {}
+    level: int = 0
+    while partials:
+        tasks = []
+        keys: Dict[str, List[str]] = {}
+        for id, summaries in partials.items():
+            groups: List[List[str]] = group_partials(summaries, token_budget)
+            if len(groups) > 1 and level >= MAX_REDUCE_LEVELS:
+                print(f"Cluster {id} still has {len(groups)} reduce groups after {level} levels, reducing over budget")
+                groups = [summaries]
+            keys[id] = [f"{id}/reduce-{level}/{g}" for g in range(len(groups))]
+            tasks.extend((key, sum(estimate_tokens(summary) for summary in group),
+                          lambda group=group: summarization_chain.ainvoke([Document(page_content=summary) for summary in group]))
+                         for key, group in zip(keys[id], groups))
+        level_results: Dict[str, Union[Dict, Exception]] = await run_llm_tasks(tasks, max_concurrency, limiter, stats)
+
+        next_partials: Dict[str, List[str]] = {}
+        for id, cluster_keys in keys.items():
+            outputs: List[Union[Dict, Exception]] = [level_results[key] for key in cluster_keys]
+            failed: int = sum(isinstance(output, Exception) for output in outputs)
+            if failed:
+                results[id] = RuntimeError(f"{failed} of {len(outputs)} reduce steps failed for cluster {id}")
+            elif len(outputs) == 1:
+                results[id] = outputs[0]
+            else:
+                next_partials[id] = [output["output_text"] for output in outputs]
+        partials = next_partials
+        level += 1
+    return results
+
+async def summarize_clusters_async(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]], summary_directory_path: str,
+                                   max_concurrency: int = LLM_MAX_CONCURRENCY, mode: str = None,
+                                   centroids: Dict[str, List[float]] = None, stats: Dict[str, float] = None) -> Dict[str, Union[Dict, Exception]]:
+    mode = mode or SUMMARY_MODE
+    prompt_version: str = get_summary_prompt_version(mode)
+    centroids = centroids or {}
+    llm = get_llm()
+    model_name: str = get_model_name()
+    summarization_chain = load_summarize_chain(llm, chain_type="stuff")
+    cache: Union[LLMCache, None] = get_llm_cache()
+    limiter: RateLimiter = RateLimiter()
+    stats = stats if stats is not None else new_runner_stats()
+
+    def finish(id: str, meta: List[Dict[str, Union[str, int, List[str]]]], cluster_hash: str, summarization_result: Dict) -> Dict:
+        if cache:
+            cache.set("summary", model_name, prompt_version, cluster_hash, summarization_result["output_text"])
+        # Each cluster is written as soon as it is done, so a crash keeps the finished ones
+        save_summary(summary_directory_path, id, summarization_result["output_text"], meta)
+        return summarization_result
+
+    async def summarize(id: str, meta: List[Dict[str, Union[str, int, List[str]]]], cluster_hash: str,
+                        prompt_records: List[Dict[str, Union[str, int, List[str]]]]) -> Dict:
+        docs: List[Document] = records_to_documents(prompt_records)
+        summarization_result: Dict = await summarization_chain.ainvoke(docs)
+        return finish(id, meta, cluster_hash, summarization_result)
+
+    results: Dict[str, Union[Dict, Exception]] = {}
+    tasks = []
+    map_reduce_clusters = []
+    for id, meta in clusters:
+        cluster_hash: str = content_hash(meta)
+        cached: Union[str, None] = cache.get("summary", model_name, prompt_version, cluster_hash) if cache else None
+        if cached is not None:
+            # Unchanged cluster: no LLM call and no rate limit budget spent
+            save_summary(summary_directory_path, id, cached, meta)
+            results[id] = {"output_text": cached}
+            continue
+
+        plan, chunks = plan_summary(meta, centroids.get(id)) if mode == "budgeted" else ("stuff", [meta])
+        if plan == "map_reduce":
+            map_reduce_clusters.append((id, meta, cluster_hash, chunks))
+            continue
+        tasks.append((id, records_tokens(chunks[0]),
+                      lambda id=id, meta=meta, cluster_hash=cluster_hash, prompt_records=chunks[0]: summarize(id, meta, cluster_hash, prompt_records)))
+
+    print(f"{len(results)} summaries served from cache, {len(tasks) + len(map_reduce_clusters)} sent to the LLM")
+    # Map chunks go in the same batch as the single-prompt clusters, under one concurrency limit
+    map_keys: Dict[str, List[str]] = {id: [f"{id}/map/{c}" for c in range(len(chunks))] for id, _, _, chunks in map_reduce_clusters}
+    for id, _, _, chunks in map_reduce_clusters:
+        tasks.extend((key, records_tokens(chunk), lambda chunk=chunk: summarization_chain.ainvoke(records_to_documents(chunk)))
+                     for key, chunk in zip(map_keys[id], chunks))
+    batch_results: Dict[str, Union[Dict, Exception]] = await run_llm_tasks(tasks, max_concurrency, limiter, stats)
+    map_results: Dict[str, Union[Dict, Exception]] = {}
+    for key, result in batch_results.items():
+        (map_results if "/map/" in key else results)[key] = result
+
+    partials: Dict[str, List[str]] = {}
+    for id, _, _, _ in map_reduce_clusters:
+        outputs: List[Union[Dict, Exception]] = [map_results[key] for key in map_keys[id]]
+        failed: int = sum(isinstance(output, Exception) for output in outputs)
+        if failed:
+            # A summary of the surviving chunks would be cached as if it covered the whole cluster
+            print(f"Map-reduce summary for {id} failed: {failed} of {len(outputs)} map steps failed")
+            results[id] = RuntimeError(f"{failed} of {len(outputs)} map steps failed for cluster {id}")
+        else:
+            partials[id] = [output["output_text"] for output in outputs]
+
+    reduced: Dict[str, Union[Dict, Exception]] = await reduce_clusters(summarization_chain, partials, limiter, stats, max_concurrency)
+    for id, meta, cluster_hash, _ in map_reduce_clusters:
+        if id not in reduced:
+            continue
+        if isinstance(reduced[id], Exception):
+            print(f"Map-reduce summary for {id} failed: {reduced[id]}")
+            results[id] = reduced[id]
+        else:
+            results[id] = finish(id, meta, cluster_hash, reduced[id])
+
+    print(f"LLM requests: {stats['requests']}, retries: {stats['retries']}, backoff: {stats['backoff_seconds']:.1f} seconds")
+    return results
+
+def get_save_summary_stats(clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]], summary_directory_path: str,
+                           centroids: Dict[str, List[float]] = None) -> None:  
+    # Clusters are summarized concurrently, paced by the requests/tokens per minute limits in llm_runner
+    st: float = time.time()
+    results: Dict[str, Union[Dict, Exception]] = asyncio.run(summarize_clusters_async(clusters, summary_directory_path, centroids=centroids))
+    failed: List[str] = [id for id, result in results.items() if isinstance(result, Exception)]
+    print(f"Summarized {len(results) - len(failed)} of {len(results)} clusters in {time.time() - st:.1f} seconds")
+    if failed:
+        print(f"Failed clusters: {failed}")
 
 def main():
     today_date: datetime.date = datetime.now().date()
@@ -73,14 +233,12 @@ def main():
         if not os.path.exists(summary_directory_path):
             os.makedirs(summary_directory_path)
 
-        clusters_directory_path: List[str] = get_all_file_paths(f".././data/{today_date}/{category}/clusters")
-        get_save_summary_stats(clusters_directory_path, summary_directory_path)
+        clusters_directory: str = f".././data/{today_date}/{category}/clusters"
+        clusters: List[Tuple[str, List[Dict[str, Union[str, int, List[str]]]]]] = load_day_clusters(clusters_directory)
+        get_save_summary_stats(clusters, summary_directory_path, load_cluster_centroids(clusters_directory))
 
 if __name__ == "__main__":
     #o_llm = ChatOpenAI(openai_api_key=os.getenv("OPENAI_API_KEY"), temperature=0, model_name="gpt-4o")
-    g_llm: GoogleGenerativeAI = GoogleGenerativeAI(temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"), model="gemini-1.5-flash-latest")
-    summarization_chain = load_summarize_chain(g_llm, chain_type="stuff")
-
     main()
 
     
\ No newline at end of file
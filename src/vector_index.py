@@ -0,0 +1,226 @@
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import argparse
+import threading
+import faiss
+import json
+import time
+import os
+from typing import Tuple, List, Any, Dict, Union
+from day_snapshot import CATEGORIES, DATE_PATTERN
+
+DATA_DIRECTORY: str = os.getenv("DATA_DIRECTORY", ".././data")
+VECTOR_INDEX_DIRECTORY: str = os.getenv("VECTOR_INDEX_DIRECTORY", ".././data/vectors")
+# "day" writes one FAISS shard per date, "month" one per YYYY-MM; searches only open the shards their date range covers
+VECTOR_SHARD_PERIOD: str = os.getenv("VECTOR_SHARD_PERIOD", "month")
+VECTOR_SHARDS_MAX_OPEN: int = int(os.getenv("VECTOR_SHARDS_MAX_OPEN", "24"))
+DAY_VECTORS_NAME: str = "embeddings.npy"
+DAY_ROWS_NAME: str = "rows.json"
+ROW_FIELDS: List[str] = ["title", "source", "url", "publish_date"]
+# Times a shard load is retried when it catches the index and its rows from different builds mid-rebuild
+SHARD_LOAD_ATTEMPTS: int = 5
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    # Inner product on unit vectors is cosine similarity
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms: np.ndarray = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def save_day_vectors(directory_path: str, clusters: List[pd.DataFrame], vectors: List[np.ndarray]) -> str:
+    # One (article, cluster) row per vector; cluster ids follow the order save_cluster_store numbers them in
+    if not os.path.exists(directory_path):
+        os.makedirs(directory_path, exist_ok=True)
+
+    rows: List[Dict[str, Any]] = []
+    for cluster_id, df_cluster in enumerate(clusters):
+        for record in df_cluster.to_dict('records'):
+            rows.append({"article_id": int(record['id']), "cluster_id": str(cluster_id),
+                         **{field: str(record.get(field, "") or "") for field in ROW_FIELDS}})
+    matrix: np.ndarray = normalize(np.vstack(vectors)) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    filename: str = os.path.join(directory_path, DAY_VECTORS_NAME)
+    with open(f"{filename}.tmp", 'wb') as file:
+        np.save(file, matrix)
+    os.replace(f"{filename}.tmp", filename)
+    rows_filename: str = os.path.join(directory_path, DAY_ROWS_NAME)
+    with open(f"{rows_filename}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(rows, file)
+    os.replace(f"{rows_filename}.tmp", rows_filename)
+    return filename
+
+def shard_name(date: str, period: str = None) -> str:
+    return date[:7] if (period or VECTOR_SHARD_PERIOD) == "month" else date
+
+def shard_dates(data_directory: str, shard: str) -> List[str]:
+    if not os.path.isdir(data_directory):
+        return []
+    return sorted(date for date in os.listdir(data_directory) if DATE_PATTERN.match(date) and date.startswith(shard))
+
+def in_range(shard: str, start_date: str = None, end_date: str = None) -> bool:
+    # A month shard overlaps the range when any of its days could; comparisons are on the shard's prefix
+    return (start_date is None or shard >= start_date[:len(shard)]) and (end_date is None or shard <= end_date[:len(shard)])
+
+def index_stamp(path: str) -> str:
+    # os.replace keeps the file's mtime, so the stamp taken from the .tmp before the swap names the swapped-in file
+    stat: os.stat_result = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+class VectorShard:
+    # One read-only FAISS index plus the rows its vector ids point at
+    def __init__(self, path: str):
+        self.path: str = path
+        # The index and its rows are two files replaced one after the other; the rows name the index build they
+        # belong to, and a load that straddles a rebuild is retried instead of pairing ids with the wrong rows
+        for attempt in range(SHARD_LOAD_ATTEMPTS):
+            stamp: str = index_stamp(path)
+            with open(f"{os.path.splitext(path)[0]}.json", 'r', encoding='utf-8') as file:
+                saved: Dict[str, Any] = json.load(file)
+            if isinstance(saved, list):
+                # Written before the rows carried a stamp; the pair cannot be checked, so the shard has to be rebuilt
+                break
+            self.index: faiss.Index = read_shard_index(path)
+            self.rows: List[Dict[str, Any]] = saved["rows"]
+            if saved["index_stamp"] == stamp == index_stamp(path) and len(self.rows) == self.index.ntotal:
+                self.stamp: str = stamp
+                return
+            time.sleep(0.05 * (attempt + 1))
+        raise RuntimeError(f"{path} does not match its rows; rebuild the shard with vector_index.py")
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        if self.index.ntotal == 0:
+            return []
+        scores, ids = self.index.search(query, min(k, self.index.ntotal))
+        return [(float(score), self.rows[id]) for score, id in zip(scores[0], ids[0]) if id >= 0]
+
+def read_shard_index(path: str) -> faiss.Index:
+    # Memory-mapped, so every API worker maps the same page-cache pages instead of holding its own copy;
+    # IO_FLAG_MMAP_IFC (faiss >= 1.8) maps flat indexes zero-copy, older builds fall back to reading the file
+    flags: int = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+class VectorIndex:
+    def __init__(self, directory: str = VECTOR_INDEX_DIRECTORY, max_open: int = VECTOR_SHARDS_MAX_OPEN):
+        self.directory: str = directory
+        self.max_open: int = max_open
+        self.shards: "OrderedDict[str, VectorShard]" = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+    def build_shard(self, shard: str, data_directory: str = DATA_DIRECTORY) -> int:
+        # Rebuilt from every day's saved vectors, so re-running a day replaces its rows instead of appending
+        vectors: List[np.ndarray] = []
+        rows: List[Dict[str, Any]] = []
+        for date in shard_dates(data_directory, shard):
+            for category in CATEGORIES:
+                directory_path: str = os.path.join(data_directory, date, category, "vectors")
+                if not os.path.exists(os.path.join(directory_path, DAY_VECTORS_NAME)):
+                    continue
+                day_vectors: np.ndarray = np.load(os.path.join(directory_path, DAY_VECTORS_NAME))
+                with open(os.path.join(directory_path, DAY_ROWS_NAME), 'r', encoding='utf-8') as file:
+                    day_rows: List[Dict[str, Any]] = json.load(file)
+                if len(day_rows) == 0:
+                    continue
+                vectors.append(day_vectors)
+                rows.extend({"date": date, "category": category, **row} for row in day_rows)
+        if not vectors:
+            return 0
+
+        matrix: np.ndarray = normalize(np.vstack(vectors))
+        # Exact search; a month of articles is a few thousand vectors, well within flat-index speed
+        index: faiss.IndexFlatIP = faiss.IndexFlatIP(matrix.shape[1])
+        index.add(matrix)
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        # The rows record which index file they were written with; VectorShard only accepts a matching pair
+        path: str = os.path.join(self.directory, f"{shard}.faiss")
+        faiss.write_index(index, f"{path}.tmp")
+        saved: Dict[str, Any] = {"index_stamp": index_stamp(f"{path}.tmp"), "rows": rows}
+        with open(f"{os.path.splitext(path)[0]}.json.tmp", 'w', encoding='utf-8') as file:
+            json.dump(saved, file)
+        os.replace(f"{os.path.splitext(path)[0]}.json.tmp", f"{os.path.splitext(path)[0]}.json")
+        os.replace(f"{path}.tmp", path)
+        return len(rows)
+
+    def build_day(self, date: str, data_directory: str = DATA_DIRECTORY) -> int:
+        return self.build_shard(shard_name(date), data_directory)
+
+    def shard_names(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.splitext(file)[0] for file in os.listdir(self.directory) if file.endswith(".faiss"))
+
+    def version(self, start_date: str = None, end_date: str = None) -> str:
+        # Changes whenever a shard the range covers is rebuilt, so results cached against it go stale with it
+        parts: List[str] = [f"{shard}:{index_stamp(os.path.join(self.directory, f'{shard}.faiss'))}"
+                            for shard in self.shard_names() if in_range(shard, start_date, end_date)]
+        return ",".join(parts) or "empty"
+
+    def get_shard(self, shard: str) -> VectorShard:
+        # Open shards are reused until the file is rebuilt; the least recently searched is closed past max_open
+        path: str = os.path.join(self.directory, f"{shard}.faiss")
+        with self.lock:
+            loaded: Union[VectorShard, None] = self.shards.get(shard)
+            if loaded is None or loaded.stamp != index_stamp(path):
+                loaded = VectorShard(path)
+                self.shards[shard] = loaded
+            self.shards.move_to_end(shard)
+            while len(self.shards) > self.max_open:
+                self.shards.popitem(last=False)
+            return loaded
+
+    def search(self, query_vector: np.ndarray, start_date: str = None, end_date: str = None, category: str = None,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        # The query is embedded once by the caller; each shard in range returns its best matches, merged by score
+        query: np.ndarray = normalize(query_vector.reshape(1, -1))
+        filtered: bool = bool(start_date or end_date or category)
+        matches: List[Tuple[float, Dict[str, Any]]] = []
+        for shard in self.shard_names():
+            if not in_range(shard, start_date, end_date):
+                continue
+            # Month shards hold days and categories outside the filter, so the search widens until `limit` rows
+            # pass it or the whole shard has been ranked
+            loaded: VectorShard = self.get_shard(shard)
+            k: int = limit * 4 if filtered else limit
+            while True:
+                kept: List[Tuple[float, Dict[str, Any]]] = [
+                    (score, row) for score, row in loaded.search(query, k)
+                    if not ((start_date and row["date"] < start_date) or (end_date and row["date"] > end_date)
+                            or (category and row["category"] != category))]
+                if len(kept) >= limit or k >= loaded.index.ntotal:
+                    break
+                k *= 4
+            matches.extend(kept)
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return [{**row, "score": round(score, 4)} for score, row in matches[:limit]]
+
+def embed_query(query: str) -> np.ndarray:
+    # Cleaned like the article texts, with the raw query kept when cleaning leaves nothing (e.g. only stopwords)
+    from k_means_cluster import encode_texts, preprocess_text
+
+    return encode_texts([preprocess_text(query) or query])[0]
+
+_vector_index: Union[VectorIndex, None] = None
+
+def get_vector_index() -> VectorIndex:
+    global _vector_index
+    if _vector_index is None:
+        _vector_index = VectorIndex()
+    return _vector_index
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build FAISS shards from the per-day article vectors")
+    parser.add_argument("--date", help="YYYY-MM-DD, rebuilds the shard holding this day; every shard when omitted")
+    args = parser.parse_args()
+
+    index: VectorIndex = VectorIndex()
+    shards: List[str] = [shard_name(args.date)] if args.date else \
+        sorted({shard_name(date) for date in shard_dates(DATA_DIRECTORY, "")})
+    for shard in shards:
+        print(f"{shard}: {index.build_shard(shard)} vectors")
+
+if __name__ == "__main__":
+    main()